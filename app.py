@@ -1,4 +1,6 @@
 import os
+import io
+import mmap
 import tempfile
 import fitz  # PyMuPDF
 import cv2
@@ -8,8 +10,12 @@ import shutil
 import psutil
 from pathlib import Path
 import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from functools import partial
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify, Response, stream_with_context, send_file
 import uuid
 import threading
 import queue
@@ -17,6 +23,11 @@ import logging
 import signal
 from werkzeug.serving import make_server
 import gc
+import hashlib
+import json
+import itertools
+import qr_backends
+import qr_shapes
 
 # Configure logging
 logging.basicConfig(
@@ -44,13 +55,60 @@ system_stats = {
 }
 
 # Job queue and worker pool
-job_queue = queue.Queue()
-MAX_CONCURRENT_JOBS = 2  # Limit concurrent jobs
+job_queue = queue.PriorityQueue()  # Async jobs, shortest (fewest pages) first
+job_sequence = itertools.count()  # Keeps equal-sized jobs in arrival order
+MAX_CONCURRENT_JOBS = 4  # Async jobs in flight; their pages share the workers through the page scheduler
 WORKER_POOL_SIZE = None  # Will be set based on CPU count
-MAX_CPU_PERCENT = 85     # Throttle if CPU exceeds this percentage
-MAX_MEMORY_PERCENT = 85  # Throttle if memory exceeds this percentage
+MAX_CPU_PERCENT = 85     # Shrink the thread engine's pool if CPU exceeds this percentage
+MAX_MEMORY_PERCENT = 85  # Shrink the thread engine's pool if memory exceeds this percentage
+MAX_BACKLOG_PAGES = 1000  # Admitted work (page-equivalents) beyond which new jobs are turned away
+MAX_INFLIGHT_BYTES = 512 * 1024 * 1024  # PDF bytes held by admitted jobs
+MAX_QUEUED_JOBS = 100    # Async jobs waiting for a job processor
+MAX_JOBS_PER_CLIENT = 4  # Admitted jobs per client at once
+COST_BYTES_PER_PAGE = 1024 * 1024  # Each MB of PDF counts as one more page of work
+MAX_RETRY_AFTER = 120    # Upper bound on the Retry-After hint, in seconds
 DEFAULT_TIMEOUT = 300    # Default timeout in seconds (5 minutes)
 PAGE_BATCH_SIZE = 10     # Process this many pages at once for large PDFs
+SAVE_DEBUG_IMAGES = False  # Debug only: round-trip page renders through PNG files in temp/
+EXECUTION_ENGINE = 'process'  # 'process' renders pages in worker processes, 'thread' uses a thread pool
+PROCESS_POOL_SIZE = None  # Warm worker processes; None follows WORKER_POOL_SIZE at startup
+WORKER_CV_THREADS = 1    # OpenCV threads per worker process (parallelism comes from the pool)
+WORKER_OPEN_DOCUMENTS = 4  # PDFs each worker keeps open between page tasks (jobs are interleaved)
+PAGE_TASK_SIZE = 1       # Pages per worker task; small tasks let short jobs overtake long ones
+PRIORITY_CLASSES = {'sync': 0, 'async': 1}  # Page tasks of lower classes are served first
+DPI_LADDER = (72, 150, 300)  # Render resolutions; rungs after the first only re-render candidate ROIs
+QR_BACKEND = 'opencv'    # Default detector backend: 'opencv', 'wechat' or 'pyzbar' (see qr_backends.py)
+RENDER_MODE = 'gray'     # 'gray' renders single-channel luminance for the detector, 'rgb' full colour
+DETECT_MAX_PIXELS = None  # Area-downsample larger renders to this many pixels before detection (None disables)
+TILED_DETECTION = True   # Render and detect regions larger than TILE_MAX_PIXELS in overlapping tiles
+TILE_MAX_PIXELS = 16000000  # Largest render detected whole (an A3 page at 300 DPI is about 17 MP)
+TILE_SIZE = 1024         # Tile side in rendered pixels
+TILE_OVERLAP = 0.25      # Fraction of a tile shared with each neighbour; smaller codes are always seen whole
+TILE_WORKERS = 2         # Tiles of a page detected in parallel while the next one renders
+FINDER_PREFILTER = True  # Only run the detector on images showing enough finder-pattern candidates
+PREFILTER_SCAN_STEP = 2  # The prefilter scans every Nth row and column for 1:1:3:1:1 runs
+PREFILTER_MIN_FINDERS = 3  # Finder-pattern candidates an image needs to reach the detector
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # In-memory budget for cached /extract_qr results
+RESULT_CACHE_TTL = 24 * 3600  # Seconds a cached result stays valid
+RESULT_CACHE_DIR = None  # Optional directory for an on-disk cache tier that survives restarts
+PAGE_CACHE_MAX_ENTRIES = 20000  # Pages whose QR results are memoized across documents
+VECTOR_PREPASS = True    # Only render page regions holding candidate images or vector paths
+MIN_QR_SIZE = 20         # Smallest QR code side we look for, in PDF points (about 7 mm)
+MIN_QR_MODULES = 21      # Modules per side of the smallest QR code (version 1)
+REGION_PADDING = 12      # PDF points added around candidate regions (the quiet zone)
+FULL_PAGE_REGION_FRACTION = 0.5  # Render the whole page once candidates cover more than this
+DIRECT_IMAGE_DECODE = True  # Decode embedded images at native resolution instead of rendering them
+DIRECT_DECODE_MIN_SIDE = 400  # Smaller embedded images are upscaled to at least this many pixels
+DIRECT_DECODE_RETRY_BELOW = 1000  # Images smaller than this are retried at twice their size
+UPLOAD_SPILL_BYTES = 32 * 1024 * 1024  # Larger uploads are spooled to a temp file and memory-mapped
+PIXMAP_BUDGET_BYTES = 256 * 1024 * 1024  # Estimated pixmap bytes that page tasks (threads and workers) may hold at once
+SAMPLE_COLOR_SCALE = 1.0  # Render scale for /sample_colors (1.0 is 72 DPI, what the editor samples at)
+SAMPLE_RING_WIDTH = 5    # Width of the ring sampled around each box, in PDF points
+SAMPLE_COLOR_METHOD = 'median'  # 'median' or 'mean' of the ring's pixels
+REDACT_PADDING = 3       # PDF points added around boxes redacted by /process_pdf (as the editor draws them)
+COVER_PAGE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cover_page.png')
+COVER_LANDSCAPE_SIZE = (1190, 1684)  # Cover page size used when the first page is landscape
+COVER_CACHE_SIZE = 8  # Prebuilt cover pages kept, one per page size
 
 # Create a lock for resource management
 resource_lock = threading.Lock()
@@ -58,6 +116,390 @@ resource_lock = threading.Lock()
 # Track running jobs
 active_jobs = {}
 job_results = {}
+job_metrics = {}  # Per-job processing metrics, reported by /job_status
+job_schedules = {}  # job_id -> (client_id, priority, submit time) for the page scheduler
+job_cancel_events = {}  # job_id -> threading.Event set when the job is cancelled or times out
+
+class UploadRequest(Request):
+    """Request that keeps uploaded files in memory up to UPLOAD_SPILL_BYTES.
+
+    Werkzeug spools anything over 500 KB to disk by default, so most PDFs
+    would still be written once before we ever see them.
+    """
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_SPILL_BYTES:
+            return io.BytesIO()
+        return tempfile.TemporaryFile('wb+')
+
+app.request_class = UploadRequest
+
+class ResultCache:
+    """LRU + TTL cache of QR results keyed on PDF content and detection parameters.
+
+    Entries are kept as serialized JSON so their memory cost is known exactly
+    and every hit hands out a fresh copy. When a disk directory is set, entries
+    are also written there and reloaded on a memory miss.
+    """
+    
+    def __init__(self, max_bytes, ttl, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()  # key -> (expires_at, payload)
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+    
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+    
+    def _store(self, key, expires_at, payload):
+        """Insert into the memory tier, evicting least recently used entries"""
+        if len(payload) > self.max_bytes:
+            return
+        
+        if key in self.entries:
+            self.current_bytes -= len(self.entries.pop(key)[1])
+        
+        while self.entries and self.current_bytes + len(payload) > self.max_bytes:
+            _, (_, stale_payload) = self.entries.popitem(last=False)
+            self.current_bytes -= len(stale_payload)
+            self.evictions += 1
+        
+        self.entries[key] = (expires_at, payload)
+        self.current_bytes += len(payload)
+    
+    def get(self, key):
+        """Return cached results for key, or None"""
+        now = time.time()
+        
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(entry[1])
+                
+                self.current_bytes -= len(self.entries.pop(key)[1])
+        
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'rb') as f:
+                    expires_at = float(f.readline())
+                    payload = f.read()
+                
+                if expires_at > now:
+                    with self.lock:
+                        self._store(key, expires_at, payload)
+                        self.disk_hits += 1
+                    return json.loads(payload)
+                
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning(f"Could not read cached result {key}: {e}")
+        
+        with self.lock:
+            self.misses += 1
+        return None
+    
+    def put(self, key, results):
+        """Cache results for key in memory and, if enabled, on disk"""
+        payload = json.dumps(results).encode('utf-8')
+        expires_at = time.time() + self.ttl
+        
+        with self.lock:
+            self._store(key, expires_at, payload)
+        
+        if self.disk_dir:
+            tmp_path = f"{self._disk_path(key)}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(f"{expires_at}\n".encode('ascii'))
+                    f.write(payload)
+                os.replace(tmp_path, self._disk_path(key))
+            except Exception as e:
+                logger.warning(f"Could not write cached result {key}: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    
+    def expire(self):
+        """Drop expired entries from both tiers and return how many were removed"""
+        now = time.time()
+        removed = 0
+        
+        with self.lock:
+            for key in [key for key, (expires_at, _) in self.entries.items() if expires_at <= now]:
+                self.current_bytes -= len(self.entries.pop(key)[1])
+                removed += 1
+        
+        if self.disk_dir:
+            for entry in os.scandir(self.disk_dir):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path, 'rb') as f:
+                        expires_at = float(f.readline())
+                    if expires_at <= now:
+                        os.remove(entry.path)
+                        removed += 1
+                except Exception as e:
+                    logger.warning(f"Could not check cached result {entry.name}: {e}")
+        
+        return removed
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL, RESULT_CACHE_DIR)
+
+def detection_params(backend=None):
+    """Parameters that change detection output and therefore invalidate cached results"""
+    return {
+        'backend': backend or QR_BACKEND,
+        'dpi_ladder': list(DPI_LADDER),
+        'render_mode': RENDER_MODE,
+        'detect_max_pixels': DETECT_MAX_PIXELS,
+        'vector_prepass': VECTOR_PREPASS,
+        'direct_image_decode': DIRECT_IMAGE_DECODE,
+        'finder_prefilter': [PREFILTER_SCAN_STEP, PREFILTER_MIN_FINDERS] if FINDER_PREFILTER else None,
+        'tiles': [TILE_MAX_PIXELS, TILE_SIZE, TILE_OVERLAP] if TILED_DETECTION else None
+    }
+
+def result_cache_key(pdf_source, backend=None):
+    """SHA-256 of the PDF content combined with the current detection parameters"""
+    digest = hashlib.sha256()
+    if isinstance(pdf_source, str):
+        with open(pdf_source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        digest.update(pdf_source)
+    
+    params = json.dumps(detection_params(backend), sort_keys=True).encode('utf-8')
+    return f"{digest.hexdigest()}-{hashlib.sha256(params).hexdigest()[:16]}"
+
+class PageCache:
+    """Bounded LRU of per-page QR results keyed on page content hashes.
+
+    Results are stored without their page number so that an identical page
+    in another document (or at another position) can reuse them.
+    """
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key, page_results):
+        stored = [{k: v for k, v in qr.items() if k != 'page'} for qr in page_results]
+        with self.lock:
+            self.entries[key] = stored
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries
+            }
+
+page_cache = PageCache(PAGE_CACHE_MAX_ENTRIES)
+
+class AdmissionController:
+    """Admits jobs based on the work already accepted, not on load samples.
+
+    Each admitted job holds its estimated cost (in page-equivalents), its PDF
+    bytes and a slot for its client until it is released. Rejections carry a
+    Retry-After hint derived from how fast admitted work has been draining.
+    """
+    
+    def __init__(self, max_cost, max_bytes, max_jobs_per_client):
+        self.max_cost = max_cost
+        self.max_bytes = max_bytes
+        self.max_jobs_per_client = max_jobs_per_client
+        self.lock = threading.Lock()
+        self.jobs = {}  # job_id -> (client_id, cost, nbytes)
+        self.cost = 0
+        self.bytes = 0
+        self.completed = deque()  # (release time, cost) over the last minute
+        self.rejected = 0
+    
+    def admit(self, job_id, client_id, cost, nbytes):
+        """Reserve capacity for a job.
+
+        Returns None when admitted, or (status, message, retry_after) when the
+        job has to be turned away. A job is always admitted when nothing else
+        is in flight, however large it is.
+        """
+        with self.lock:
+            client_costs = [job[1] for job in self.jobs.values() if job[0] == client_id]
+            if len(client_costs) >= self.max_jobs_per_client:
+                self.rejected += 1
+                return 429, f"Client already has {len(client_costs)} jobs in progress", self._retry_after(min(client_costs))
+            
+            if self.jobs and self.cost + cost > self.max_cost:
+                self.rejected += 1
+                return 503, "Too much work is queued. Please try again later.", self._retry_after(self.cost + cost - self.max_cost)
+            
+            if self.jobs and self.bytes + nbytes > self.max_bytes:
+                self.rejected += 1
+                return 503, "Too many PDFs are in flight. Please try again later.", self._retry_after(min(job[1] for job in self.jobs.values()))
+            
+            self.jobs[job_id] = (client_id, cost, nbytes)
+            self.cost += cost
+            self.bytes += nbytes
+            return None
+    
+    def release(self, job_id):
+        """Give back a finished (or failed, or cancelled) job's capacity; safe to repeat"""
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                return
+            
+            _, cost, nbytes = job
+            self.cost -= cost
+            self.bytes -= nbytes
+            self.completed.append((time.time(), cost))
+    
+    def retry_after(self, cost):
+        """Seconds until roughly `cost` page-equivalents of admitted work have drained"""
+        with self.lock:
+            return self._retry_after(cost)
+    
+    def _retry_after(self, cost):
+        now = time.time()
+        while self.completed and now - self.completed[0][0] > 60:
+            self.completed.popleft()
+        
+        # Until there is a minute of history, assume a page per second
+        pages_per_second = max(1.0, sum(job_cost for _, job_cost in self.completed) / 60)
+        return int(min(MAX_RETRY_AFTER, max(1, -(-cost // pages_per_second))))
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'admitted_jobs': len(self.jobs),
+                'backlog_pages': round(self.cost, 1),
+                'max_backlog_pages': self.max_cost,
+                'inflight_bytes': self.bytes,
+                'clients': len({job[0] for job in self.jobs.values()}),
+                'rejected': self.rejected
+            }
+
+admission = AdmissionController(MAX_BACKLOG_PAGES, MAX_INFLIGHT_BYTES, MAX_JOBS_PER_CLIENT)
+
+def estimate_job_cost(page_count, nbytes):
+    """Estimated work for a PDF in page-equivalents; large files mean heavy images"""
+    return max(1, page_count) + nbytes / COST_BYTES_PER_PAGE
+
+def page_cache_key(pdf_document, page, stream_digests, backend=None):
+    """Hash what a page renders from: content streams, resources and render parameters.
+
+    Resources are hashed by decoded content rather than by xref number or
+    compression, so the same page in two differently built files gets the
+    same key. stream_digests memoizes per-xref digests for images and forms
+    shared between pages.
+    """
+    def stream_digest(xref):
+        if xref not in stream_digests:
+            stream_digests[xref] = hashlib.sha256(pdf_document.xref_stream(xref) or b'').hexdigest()
+        return stream_digests[xref]
+    
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.rect), tuple(page.mediabox), page.rotation)).encode('utf-8'))
+    
+    for xref in page.get_contents():
+        digest.update(pdf_document.xref_stream(xref) or b'')
+    
+    for image in page.get_images(full=True):
+        # (xref, smask, width, height, bpc, colorspace, alt. colorspace, name, filter, referencer)
+        digest.update(repr((image[7], image[2], image[3], image[4], image[5])).encode('utf-8'))
+        digest.update(stream_digest(image[0]).encode('ascii'))
+        if image[1]:
+            digest.update(stream_digest(image[1]).encode('ascii'))
+    
+    for xobject in page.get_xobjects():
+        # (xref, name, invoker, bbox)
+        digest.update(xobject[1].encode('utf-8'))
+        digest.update(stream_digest(xobject[0]).encode('ascii'))
+    
+    for font in page.get_fonts(full=True):
+        # (xref, ext, type, basefont, name, encoding, referencer)
+        digest.update(repr(font[1:6]).encode('utf-8'))
+    
+    digest.update(json.dumps(detection_params(backend), sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+# Worker processes are spawned rather than forked so they never inherit
+# locks held by Flask or monitor threads
+mp_context = multiprocessing.get_context('spawn')
+
+# Per-process state of page workers (only set inside worker processes)
+worker_documents = OrderedDict()
+worker_image_results = {}  # pdf_ref -> {backend: {xref: decoded QR codes}} for the open documents
+
+# Names of the detector backends usable here, found on first use
+available_qr_backends = None
+
+# Largest pixmap rendered by the current page task, per thread
+render_tracker = threading.local()
+
+# Detection stage timings of the current page task, per thread
+stage_tracker = threading.local()
+
+# Bytes of COVER_PAGE_PATH, read on first use
+cover_page_image = None
+
+# Prebuilt one-page cover PDFs, per page size, most recently used last
+cover_pdfs = OrderedDict()
+cover_pdfs_lock = threading.Lock()
+
+# Threads scanning the tiles of large renders (per process), started on first use
+tile_executor = None
+tile_executor_lock = threading.Lock()
+
+# Long-lived pool of warm page workers, started by main() or on first use
+page_worker_pool = None
+page_worker_pool_lock = threading.Lock()
 
 def monitor_system_resources():
     """Periodically update system resource statistics"""
@@ -108,7 +550,16 @@ def job_processor():
     while True:
         try:
             # Get job from queue
-            job_id, pdf_path, callback = job_queue.get(block=True)
+            _, _, (job_id, pdf_source, filename, callback, cache_key, backend) = job_queue.get(block=True)
+            
+            # Jobs cancelled while queued are dropped without being started
+            if is_job_cancelled(job_id):
+                with resource_lock:
+                    system_stats['queued_jobs'] -= 1
+                logger.info(f"Skipping cancelled job {job_id}")
+                admission.release(job_id)
+                job_queue.task_done()
+                continue
             
             with resource_lock:
                 system_stats['queued_jobs'] -= 1
@@ -116,14 +567,14 @@ def job_processor():
                 active_jobs[job_id] = {
                     'start_time': time.time(),
                     'status': 'processing',
-                    'pdf_path': pdf_path
+                    'filename': filename
                 }
             
-            logger.info(f"Starting job {job_id} for PDF: {pdf_path}")
+            logger.info(f"Starting job {job_id} for PDF: {filename}")
             
             try:
                 # Process the job with timeout
-                result = process_pdf_with_timeout(pdf_path, job_id)
+                result = process_pdf_with_timeout(pdf_source, job_id, cache_key=cache_key, backend=backend)
                 
                 # Store the result
                 with resource_lock:
@@ -149,7 +600,7 @@ def job_processor():
                 # Store the error
                 with resource_lock:
                     job_results[job_id] = {
-                        'status': 'failed',
+                        'status': 'cancelled' if is_job_cancelled(job_id) else 'failed',
                         'error': str(e),
                         'completion_time': time.time()
                     }
@@ -169,12 +620,9 @@ def job_processor():
                     system_stats['active_jobs'] -= 1
                     system_stats['completed_jobs'] += 1
                 
-                # Clean up the specific PDF file
-                try:
-                    if os.path.exists(pdf_path):
-                        os.remove(pdf_path)
-                except Exception as e:
-                    logger.warning(f"Could not remove PDF file {pdf_path}: {e}")
+                # Release the in-memory (or memory-mapped) upload and its admission
+                pdf_source = None
+                admission.release(job_id)
                 
                 # Mark the job as done in the queue
                 job_queue.task_done()
@@ -193,7 +641,27 @@ def start_job_processors(num_processors):
         processor.start()
         logger.info(f"Started job processor {i+1}")
 
-def process_pdf_with_timeout(pdf_path, job_id, timeout=DEFAULT_TIMEOUT):
+def job_cancel_event(job_id):
+    """Return a job's cancellation token, creating it on first use"""
+    with resource_lock:
+        return job_cancel_events.setdefault(job_id, threading.Event())
+
+def is_job_cancelled(job_id):
+    """Whether a job has been cancelled or timed out"""
+    cancel_event = job_cancel_events.get(job_id)
+    return cancel_event is not None and cancel_event.is_set()
+
+def cancel_job(job_id):
+    """Cancel a queued or running job and free its CPU and memory right away.
+
+    Sets the job's token, which job processors and the thread engine check
+    between pages, and drops or kills the job's tasks in the page workers.
+    """
+    job_cancel_event(job_id).set()
+    cancelled_tasks = page_worker_pool.cancel_job(job_id) if page_worker_pool else 0
+    logger.info(f"Cancelled job {job_id} ({cancelled_tasks} page tasks dropped or interrupted)")
+
+def process_pdf_with_timeout(pdf_path, job_id, timeout=DEFAULT_TIMEOUT, cache_key=None, backend=None):
     """Process PDF with timeout protection"""
     result = []
     
@@ -203,7 +671,7 @@ def process_pdf_with_timeout(pdf_path, job_id, timeout=DEFAULT_TIMEOUT):
     def target():
         try:
             # Process the PDF
-            qr_positions = extract_qr_positions_from_pdf(pdf_path, job_id=job_id)
+            qr_positions = extract_qr_positions_from_pdf(pdf_path, job_id=job_id, cache_key=cache_key, backend=backend)
             result_queue.put(('success', qr_positions))
         except Exception as e:
             result_queue.put(('error', str(e)))
@@ -221,12 +689,18 @@ def process_pdf_with_timeout(pdf_path, job_id, timeout=DEFAULT_TIMEOUT):
         return data
     except queue.Empty:
         logger.error(f"Job {job_id} timed out after {timeout} seconds")
+        cancel_job(job_id)
         raise Exception(f"Processing timed out after {timeout} seconds")
 
 @app.route('/system_stats', methods=['GET'])
 def get_system_stats():
     """API endpoint to get current system statistics"""
-    return jsonify(system_stats)
+    scheduler_stats = page_worker_pool.tasks.stats() if page_worker_pool else None
+    return jsonify({**system_stats, 'result_cache': result_cache.stats(), 'page_cache': page_cache.stats(),
+                    'scheduler': scheduler_stats, 'admission': admission.stats(),
+                    'pixmap_budget': pixmap_budget.stats(), 'detection_stages': detection_stages.stats(),
+                    'qr_backend': QR_BACKEND,
+                    'available_backends': get_available_backends()})
 
 @app.route('/job_status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
@@ -237,7 +711,7 @@ def get_job_status(job_id):
         return jsonify({
             'status': 'processing',
             'elapsed_seconds': elapsed_time,
-            'pdf_path': active_jobs[job_id]['pdf_path']
+            'filename': active_jobs[job_id]['filename']
         })
     
     # Check if job has completed
@@ -248,6 +722,7 @@ def get_job_status(job_id):
             return jsonify({
                 'status': result['status'],
                 'qr_count': len(result['result']),
+                'metrics': job_metrics.get(job_id, {}),
                 'result': result['result']
             })
         # For failed jobs, include the error
@@ -260,12 +735,194 @@ def get_job_status(job_id):
     # Job not found
     return jsonify({'status': 'not_found'}), 404
 
+def requested_stream_format():
+    """Return 'ndjson' or 'sse' when the client asked for streamed results"""
+    stream_format = request.form.get('stream', '').lower()
+    if stream_format in ('ndjson', 'sse'):
+        return stream_format
+    
+    accept = request.headers.get('Accept', '')
+    if 'text/event-stream' in accept:
+        return 'sse'
+    if 'application/x-ndjson' in accept:
+        return 'ndjson'
+    return None
+
+def format_stream_event(event, data, stream_format):
+    """Serialize one streamed event as an NDJSON line or an SSE message"""
+    if stream_format == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({'event': event, **data}) + "\n"
+
+def stream_qr_results(job_id, pdf_source, timeout, cache_key, stream_format, cached_result=None, backend=None):
+    """Generate streamed events for a job as its pages complete.
+
+    Emits 'start', then a 'page' (or 'page_error') and a 'progress' event per
+    finished page, and finally 'summary' or 'error'. Extraction runs in a
+    background thread.
+    """
+    events = queue.Queue()
+    
+    def on_page(page_num, num_pages, page_results, error=None):
+        events.put(('page', page_num, num_pages, page_results, error))
+    
+    def target():
+        try:
+            result = extract_qr_positions_from_pdf(pdf_source, job_id=job_id, cache_key=cache_key, on_page=on_page,
+                                                   backend=backend)
+            events.put(('done', result))
+        except Exception as e:
+            events.put(('error', str(e)))
+    
+    if cached_result is not None:
+        # Replay the cached result page by page; empty pages aren't known
+        results_by_page = group_results_by_page(cached_result)
+        for page_num in sorted(results_by_page):
+            events.put(('page', page_num, None, results_by_page[page_num], None))
+        events.put(('done', cached_result))
+    else:
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+    
+    deadline = time.time() + timeout
+    completed_pages = 0
+    failed_pages = []
+    finished = False
+    
+    try:
+        # Inside the try, so a client that leaves right after 'start' still cancels the job
+        yield format_stream_event('start', {'job_id': job_id, 'cached': cached_result is not None}, stream_format)
+        
+        while not finished:
+            try:
+                item = events.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                logger.error(f"Streaming job {job_id} timed out after {timeout} seconds")
+                cancel_job(job_id)
+                item = ('error', f"Processing timed out after {timeout} seconds")
+            
+            if item[0] == 'page':
+                _, page_num, num_pages, page_results, error = item
+                completed_pages += 1
+                if error is None:
+                    yield format_stream_event('page', {'page': page_num + 1, 'results': page_results}, stream_format)
+                else:
+                    failed_pages.append(page_num + 1)
+                    yield format_stream_event('page_error', {'page': page_num + 1, 'error': error}, stream_format)
+                
+                if num_pages is not None:
+                    yield format_stream_event('progress', {
+                        'completed_pages': completed_pages,
+                        'total_pages': num_pages
+                    }, stream_format)
+            
+            elif item[0] == 'done':
+                finished = True
+                result = item[1]
+                with resource_lock:
+                    job_results[job_id] = {
+                        'status': 'completed',
+                        'result': result,
+                        'completion_time': time.time()
+                    }
+                
+                yield format_stream_event('summary', {
+                    'job_id': job_id,
+                    'status': 'completed',
+                    'cached': cached_result is not None,
+                    'qr_count': len(result),
+                    'failed_pages': sorted(failed_pages),
+                    'metrics': job_metrics.get(job_id, {}),
+                    'status_url': f"/job_status/{job_id}"
+                }, stream_format)
+            
+            else:
+                finished = True
+                status = 'cancelled' if is_job_cancelled(job_id) else 'failed'
+                with resource_lock:
+                    job_results[job_id] = {
+                        'status': status,
+                        'error': item[1],
+                        'completion_time': time.time()
+                    }
+                
+                yield format_stream_event('error', {'job_id': job_id, 'status': status, 'error': item[1]}, stream_format)
+    finally:
+        # A client that disconnects mid-stream takes its job down with it
+        if not finished:
+            cancel_job(job_id)
+
+def request_client_id():
+    """Identify the client for fair scheduling: X-Client-Id, client_id or the remote address"""
+    return request.headers.get('X-Client-Id') or request.form.get('client_id') or request.remote_addr or 'unknown'
+
+def count_pdf_pages(pdf_source):
+    """Page count used to order queued jobs; 0 if the PDF can't be opened yet"""
+    try:
+        if isinstance(pdf_source, str):
+            pdf_document = fitz.open(pdf_source)
+        else:
+            pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+        with pdf_document:
+            return len(pdf_document)
+    except Exception:
+        return 0
+
+def read_upload(file):
+    """Return an uploaded file's content without writing it to disk.
+
+    Uploads up to UPLOAD_SPILL_BYTES are already in memory. Larger ones were
+    spooled by UploadRequest and are memory-mapped rather than read into a copy.
+    """
+    stream = file.stream
+    if isinstance(stream, io.BytesIO):
+        return stream.getvalue()
+    
+    stream.flush()
+    if os.fstat(stream.fileno()).st_size == 0:
+        return b''
+    
+    # The mapping stays valid after Werkzeug closes the spooled file
+    return memoryview(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+
+@app.route('/job/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """API endpoint to cancel a queued or running job"""
+    if job_id in job_results:
+        return jsonify({
+            'job_id': job_id,
+            'status': job_results[job_id]['status'],
+            'error': 'Job has already finished'
+        }), 409
+    
+    if job_id not in job_schedules:
+        return jsonify({'status': 'not_found'}), 404
+    
+    cancel_job(job_id)
+    
+    with resource_lock:
+        job_results[job_id] = {
+            'status': 'cancelled',
+            'error': 'Job was cancelled',
+            'completion_time': time.time()
+        }
+    
+    return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
+def overloaded_response(status, message, retry_after):
+    """A 503/429 rejection with a Retry-After header"""
+    response = jsonify({'error': message, 'retry_after': retry_after, 'admission': admission.stats()})
+    response.status_code = status
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/extract_qr', methods=['POST'])
 def extract_qr():
-    """API endpoint to extract QR codes from a PDF"""
-    pdf_path = None
-    upload_dir = None
-    
+    """API endpoint to extract QR codes from a PDF.
+
+    Results are returned as one JSON document, queued with async=true, or
+    streamed page by page with stream=ndjson|sse (or a matching Accept header).
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
     
@@ -279,44 +936,86 @@ def extract_qr():
     except ValueError:
         timeout = DEFAULT_TIMEOUT
     
-    # Check if system is overloaded
-    if system_stats['cpu_percent'] > MAX_CPU_PERCENT or system_stats['memory_percent'] > MAX_MEMORY_PERCENT:
-        return jsonify({
-            'error': 'System is currently overloaded. Please try again later.',
-            'cpu': system_stats['cpu_percent'],
-            'memory': system_stats['memory_percent']
-        }), 503
+    # Optional detector backend for this request
+    backend = request.form.get('backend') or QR_BACKEND
+    if backend not in get_available_backends():
+        return jsonify({'error': f"Unknown or unavailable backend '{backend}'",
+                        'available_backends': get_available_backends()}), 400
+    
+    job_id = str(uuid.uuid4())
+    admitted = False
     
     try:
-        # Generate job ID
-        job_id = str(uuid.uuid4())
         
-        # Create a unique upload directory
-        upload_dir = os.path.join(os.getcwd(), "uploads", f"qr_api_{job_id}")
-        os.makedirs(upload_dir, exist_ok=True)
+        # The upload is processed straight from memory (or its memory-mapped spill file)
+        pdf_data = read_upload(file)
+        if len(pdf_data) == 0:
+            return jsonify({'error': 'Uploaded file is empty'}), 400
+        
+        # Check if this should be a synchronous, streamed or asynchronous request
+        stream_format = requested_stream_format()
+        async_mode = stream_format is None and request.form.get('async', 'false').lower() == 'true'
         
-        # Save the uploaded PDF
-        pdf_filename = f"{job_id}_{file.filename}"
-        pdf_path = os.path.join(upload_dir, pdf_filename)
+        client_id = request_client_id()
         
-        file.save(pdf_path)
+        # Resubmitted PDFs are answered from the result cache
+        cache_key = result_cache_key(pdf_data, backend)
+        cached_result = result_cache.get(cache_key)
         
-        # Verify the file exists and has content
-        if not os.path.exists(pdf_path):
-            return jsonify({'error': 'Failed to save uploaded file'}), 500
+        # Anything else has to fit in the backlog of admitted work
+        if cached_result is None:
+            page_count = count_pdf_pages(pdf_data)
+            cost = estimate_job_cost(page_count, len(pdf_data))
             
-        if os.path.getsize(pdf_path) == 0:
-            return jsonify({'error': 'Uploaded file is empty'}), 400
+            if async_mode and system_stats['queued_jobs'] >= MAX_QUEUED_JOBS:
+                return overloaded_response(503, "The job queue is full. Please try again later.",
+                                           admission.retry_after(cost))
+            
+            rejection = admission.admit(job_id, client_id, cost, len(pdf_data))
+            if rejection:
+                return overloaded_response(*rejection)
+            admitted = True
+            
+            # Page tasks of callers waiting on the response go ahead of queued jobs.
+            # Only admitted jobs are scheduled, so rejected or cached ids can't be cancelled later
+            priority = PRIORITY_CLASSES['async' if async_mode else 'sync']
+            with resource_lock:
+                job_schedules[job_id] = (client_id, priority, time.time())
         
-        # Check if this should be a synchronous or asynchronous request
-        async_mode = request.form.get('async', 'false').lower() == 'true'
+        if stream_format:
+            events = stream_qr_results(job_id, pdf_data, timeout, cache_key, stream_format,
+                                       cached_result=cached_result, backend=backend)
+            mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+            response = Response(stream_with_context(events), mimetype=mimetype,
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            # Runs even if the client goes away before the stream starts
+            response.call_on_close(lambda: admission.release(job_id))
+            return response
+        
+        if cached_result is not None:
+            logger.info(f"Serving job {job_id} from result cache ({len(cached_result)} QR codes)")
+            
+            with resource_lock:
+                job_results[job_id] = {
+                    'status': 'completed',
+                    'result': cached_result,
+                    'completion_time': time.time()
+                }
+            
+            return jsonify({
+                'job_id': job_id,
+                'status': 'completed',
+                'cached': True,
+                'result': cached_result
+            })
         
         if async_mode:
             # Add job to queue
             with resource_lock:
                 system_stats['queued_jobs'] += 1
             
-            job_queue.put((job_id, pdf_path, None))
+            job_queue.put((page_count, next(job_sequence),
+                           (job_id, pdf_data, file.filename, None, cache_key, backend)))
             
             return jsonify({
                 'job_id': job_id,
@@ -327,7 +1026,7 @@ def extract_qr():
         else:
             # Process immediately (but still with timeout)
             try:
-                result = process_pdf_with_timeout(pdf_path, job_id, timeout)
+                result = process_pdf_with_timeout(pdf_data, job_id, timeout, cache_key=cache_key, backend=backend)
                 
                 # Store result for potential later retrieval
                 with resource_lock:
@@ -349,220 +1048,1653 @@ def extract_qr():
                     'status': 'failed',
                     'error': str(e)
                 }), 500
+            finally:
+                admission.release(job_id)
             
     except Exception as e:
         logger.error(f"Error setting up PDF processing: {e}")
+        if admitted:
+            admission.release(job_id)
         return jsonify({'error': f'Error processing PDF: {str(e)}'}), 500
-    finally:
-        # Clean up in case of immediate failure
-        if not async_mode and pdf_path and os.path.exists(pdf_path):
-            try:
-                os.remove(pdf_path)
-            except Exception as cleanup_error:
-                logger.warning(f"Could not remove temporary PDF: {cleanup_error}")
-                
-        if upload_dir and os.path.exists(upload_dir) and not async_mode:
-            try:
-                shutil.rmtree(upload_dir, ignore_errors=True)
-            except Exception as cleanup_error:
-                logger.warning(f"Could not remove temporary directory: {cleanup_error}")
 
-def process_page(page_info, temp_dir, qr_detector=None):
-    """Process a single PDF page to extract QR codes"""
-    page_num, page, page_width, page_height = page_info
-    page_results = []
+def parse_color_boxes(raw_boxes):
+    """Validate /sample_colors boxes and return (page_num, [x0, y0, x1, y1]) for each.
+
+    A box is {'page': n, 'bbox': {...}} with a 1-based page and the bbox
+    either as /extract_qr returns it (x1, y1, x2, y2) or as the editor
+    uses it (x0, y0, x1, y1).
+    """
+    if not isinstance(raw_boxes, list):
+        raise ValueError("boxes must be a JSON list")
     
-    # Create a unique filename for this page
-    temp_filename = os.path.join(temp_dir, f"page_{page_num}.png")
+    boxes = []
+    for box in raw_boxes:
+        bbox = box['bbox']
+        if 'x2' in bbox:
+            coords = [float(bbox['x1']), float(bbox['y1']), float(bbox['x2']), float(bbox['y2'])]
+        else:
+            coords = [float(bbox['x0']), float(bbox['y0']), float(bbox['x1']), float(bbox['y1'])]
+        boxes.append((int(box['page']) - 1, coords))
+    return boxes
+
+def ring_bounds(coords, scale, ring, width, height):
+    """Pixel bounds (x0, y0, x1, y1) of the boxes and of their rings' outer edges, clipped to the render"""
+    coords = np.asarray(coords, dtype=np.float64) * scale
+    inner = np.empty(coords.shape, dtype=np.int64)
+    inner[:, :2] = np.floor(np.minimum(coords[:, :2], coords[:, 2:]))
+    inner[:, 2:] = np.ceil(np.maximum(coords[:, :2], coords[:, 2:]))
+    outer = inner + [-ring, -ring, ring, ring]
+    limits = [width, height, width, height]
+    return np.clip(inner, 0, limits), np.clip(outer, 0, limits)
+
+def ring_means(img, inner, outer):
+    """Mean colour and pixel count of every ring, from one integral image of the render"""
+    integral = cv2.integral(img, sdepth=cv2.CV_64F)
     
-    try:
-        # Make sure temp directory exists
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        # Use a more memory-efficient approach with a lower DPI for initial check
-        # Start with a lower resolution for faster processing
-        dpi = 150  # Lower DPI uses less memory but might miss small QR codes
-        pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
-        
-        # Save the pixmap
-        pix.save(temp_filename)
-        
-        # Explicitly delete the pixmap to free memory
-        del pix
-        
-        # Check if the file was created
-        if not os.path.exists(temp_filename) or os.path.getsize(temp_filename) == 0:
-            raise Exception(f"Failed to create image file at {temp_filename}")
-        
-        # Read the image with OpenCV
-        img = cv2.imread(temp_filename)
-        
-        if img is None:
-            # Try PIL as fallback
-            try:
-                from PIL import Image
-                pil_img = Image.open(temp_filename)
-                img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-                del pil_img  # Free memory
-            except Exception as pil_err:
-                raise Exception(f"Failed to load image: {pil_err}")
-        
-        # Process at lower resolution first
-        # Detect QR codes
-        if qr_detector is None:
-            qr_detector = cv2.QRCodeDetector()
+    def area_sums(bounds):
+        x0, y0, x1, y1 = bounds.T
+        return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    
+    def areas(bounds):
+        return (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+    
+    counts = areas(outer) - areas(inner)
+    sums = area_sums(outer) - area_sums(inner)
+    return sums / np.maximum(counts, 1)[:, None], counts
+
+def ring_medians(img, inner, outer):
+    """Median colour and pixel count of every ring.
+
+    The rings' pixels are gathered into one array and sorted per channel
+    with the ring index as the high part of the key, so every ring's median
+    comes out of a single sort.
+    """
+    strips = []
+    counts = np.zeros(len(inner), dtype=np.int64)
+    for i, ((ix0, iy0, ix1, iy1), (ox0, oy0, ox1, oy1)) in enumerate(zip(inner.tolist(), outer.tolist())):
+        # Above and below the box (corners included), then left and right of it
+        for strip in (img[oy0:iy0, ox0:ox1], img[iy1:oy1, ox0:ox1], img[iy0:iy1, ox0:ix0], img[iy0:iy1, ix1:ox1]):
+            if strip.size:
+                strips.append(strip.reshape(-1, img.shape[2]))
+                counts[i] += len(strips[-1])
+    
+    medians = np.zeros((len(inner), img.shape[2]))
+    if not strips:
+        return medians, counts
+    
+    ring_index = np.repeat(np.arange(len(inner), dtype=np.int64), counts)
+    values = np.sort(ring_index[:, None] * 256 + np.concatenate(strips), axis=0) % 256
+    
+    # Middle element(s) of each ring's run of sorted values
+    starts = np.cumsum(counts) - counts
+    sampled = counts > 0
+    low = (starts + (counts - 1) // 2)[sampled]
+    high = (starts + counts // 2)[sampled]
+    medians[sampled] = (values[low] + values[high]) / 2
+    return medians, counts
+
+def sample_box_colors(pdf_source, boxes, scale=SAMPLE_COLOR_SCALE, ring_width=SAMPLE_RING_WIDTH,
+                      method=SAMPLE_COLOR_METHOD):
+    """Colour of the ring around each box, rendering every page that has boxes once.
+
+    Returns ([(r, g, b) in 0..1 or None when the ring is off the page, ...],
+    pages rendered), in the order of boxes.
+    """
+    if isinstance(pdf_source, str):
+        pdf_document = fitz.open(pdf_source)
+    else:
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    
+    with pdf_document:
+        return sample_document_colors(pdf_document, boxes, scale, ring_width, method)
+
+def sample_document_colors(pdf_document, boxes, scale=SAMPLE_COLOR_SCALE, ring_width=SAMPLE_RING_WIDTH,
+                           method=SAMPLE_COLOR_METHOD):
+    """sample_box_colors for a document that is already open"""
+    ring = max(1, round(ring_width * scale))
+    colors = [None] * len(boxes)
+    
+    pages = {}
+    for index, (page_num, coords) in enumerate(boxes):
+        pages.setdefault(page_num, []).append((index, coords))
+    
+    for page_num, page_boxes in sorted(pages.items()):
+        if not 0 <= page_num < len(pdf_document):
+            raise ValueError(f"Page {page_num + 1} is out of range (the PDF has {len(pdf_document)} pages)")
         
-        retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(img)
+        page = pdf_document[page_num]
+        render_bytes = int(-(-page.rect.width * scale // 1) * -(-page.rect.height * scale // 1) * 3)
         
-        # If no QR codes found at low resolution and the image is large enough,
-        # try again with higher resolution but only if CPU/memory isn't already stressed
-        if not retval and img.shape[0] > 1000 and img.shape[1] > 1000:
-            with resource_lock:
-                cpu_ok = system_stats['cpu_percent'] < MAX_CPU_PERCENT * 0.8
-                mem_ok = system_stats['memory_percent'] < MAX_MEMORY_PERCENT * 0.8
+        with pixmap_budget.reserve(render_bytes):
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csRGB, alpha=False)
+            pixmap_budget.record_used(pix.width * pix.height * pix.n)
             
-            if cpu_ok and mem_ok:
-                # Try higher resolution
-                logger.info(f"Retrying page {page_num + 1} with higher resolution")
-                
-                # Free the previous image from memory
-                del img
-                
-                # Remove the low-res temp file
-                try:
-                    if os.path.exists(temp_filename):
-                        os.remove(temp_filename)
-                except:
-                    pass
-                
-                # Create a higher resolution image
-                dpi = 300  # Higher DPI for better detection
-                pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72))
-                pix.save(temp_filename)
-                del pix  # Free memory
-                
-                # Load the higher-res image
-                img = cv2.imread(temp_filename)
-                if img is None:
-                    raise Exception("Failed to load higher-resolution image")
-                
-                # Try detection again
-                retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(img)
-        
-        if retval:
-            # Image dimensions
-            img_height, img_width = img.shape[:2]
-            
-            # Scale factors to convert image coordinates to PDF coordinates
-            scale_x = page_width / img_width
-            scale_y = page_height / img_height
-            
-            # Process each QR code found
-            for i, qr_points in enumerate(points):
-                # Convert to a four-point array if needed
-                qr_points = qr_points.astype(int)
-                
-                # Convert polygon coordinates to PDF coordinates
-                pdf_points = [
-                    (int(p[0] * scale_x), int(p[1] * scale_y)) for p in qr_points
-                ]
-                
-                # Calculate bounding box in PDF coordinates
-                x_values = [p[0] for p in pdf_points]
-                y_values = [p[1] for p in pdf_points]
-                
-                min_x, max_x = min(x_values), max(x_values)
-                min_y, max_y = min(y_values), max(y_values)
-                
-                # Store QR code information
-                qr_info = {
-                    'page': page_num + 1,  # 1-based page number
-                    'polygon': pdf_points,
-                    'bbox': {
-                        'x1': min_x,
-                        'y1': min_y,
-                        'x2': max_x,
-                        'y2': max_y,
-                        'width': max_x - min_x,
-                        'height': max_y - min_y
-                    },
-                    'center': {
-                        'x': (min_x + max_x) / 2,
-                        'y': (min_y + max_y) / 2
-                    },
-                    'data': decoded_info[i] if i < len(decoded_info) else "Unable to decode"
-                }
-                
-                page_results.append(qr_info)
-        
-        # Free memory
-        del img
-    
-    except Exception as e:
-        logger.error(f"Error processing page {page_num + 1}: {e}")
-        raise
-    
-    finally:
-        # Clean up the temp file
-        try:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-        except Exception as e:
-            logger.warning(f"Could not remove temp file {temp_filename}: {e}")
+            # Boxes are in page coordinates, the render starts at the page's top-left corner
+            coords = np.array([box for _, box in page_boxes]) - np.tile([page.rect.x0, page.rect.y0], 2)
+            inner, outer = ring_bounds(coords, scale, ring, pix.width, pix.height)
+            
+            sampler = ring_medians if method == 'median' else ring_means
+            values, counts = sampler(pixmap_to_array(pix), inner, outer)
+            del pix
         
-        # Force garbage collection to free memory
-        gc.collect()
+        for (index, _), value, count in zip(page_boxes, values.tolist(), counts.tolist()):
+            if count:
+                colors[index] = tuple(channel / 255 for channel in value)
     
-    return page_results
+    return colors, len(pages)
 
-def process_page_batch(page_batch, temp_dir, job_id):
-    """Process a batch of pages and return combined results"""
-    batch_results = []
-    qr_detector = cv2.QRCodeDetector()  # Create once and reuse
+@app.route('/sample_colors', methods=['POST'])
+def sample_colors():
+    """API endpoint to sample the background colour around many boxes of a PDF at once.
+
+    Takes the PDF ('file') and a JSON list of boxes ('boxes', see
+    parse_color_boxes) in PDF points. Optional fields: 'scale' (render scale),
+    'ring' (ring width in points), 'method' ('median' or 'mean') and 'divide',
+    which box coordinates are divided by as in the editor's getSurroundingColor.
+    Boxes whose ring lies off the page get white.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
     
-    logger.info(f"Processing batch of {len(page_batch)} pages for job {job_id}")
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
     
-    for page_info in page_batch:
-        try:
-            # Process page with shared detector
-            page_results = process_page(page_info, temp_dir, qr_detector)
-            batch_results.extend(page_results)
-            
-            # Update processed page count
-            with resource_lock:
-                system_stats['processed_pages'] += 1
-                
-        except Exception as e:
-            logger.error(f"Error in batch processing page {page_info[0] + 1}: {e}")
-            # Continue processing other pages despite errors
+    try:
+        boxes = parse_color_boxes(json.loads(request.form.get('boxes', '[]')))
+        scale = float(request.form.get('scale', SAMPLE_COLOR_SCALE))
+        ring_width = float(request.form.get('ring', SAMPLE_RING_WIDTH))
+        divide = float(request.form.get('divide', 1))
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': f'Invalid boxes or parameters: {e}'}), 400
     
-    # Clean up detector to free memory
-    del qr_detector
+    method = request.form.get('method', SAMPLE_COLOR_METHOD)
+    if method not in ('median', 'mean'):
+        return jsonify({'error': f"Unknown method '{method}' (use 'median' or 'mean')"}), 400
+    if scale <= 0 or ring_width <= 0 or divide <= 0:
+        return jsonify({'error': 'scale, ring and divide must be positive'}), 400
     
-    return batch_results
-
-def extract_qr_positions_from_pdf(pdf_path, job_id=None):
-    """Extract positions of QR codes from a PDF file"""
-    results = []
+    boxes = [(page_num, [c / divide for c in coords]) for page_num, coords in boxes]
     
-    # Create a temporary directory for this job
-    temp_dir = os.path.join(os.getcwd(), "temp", f"qr_extract_{job_id or uuid.uuid4()}")
     try:
-        os.makedirs(temp_dir, exist_ok=True)
-        logger.info(f"Created temporary directory: {temp_dir}")
+        pdf_data = read_upload(file)
+        if len(pdf_data) == 0:
+            return jsonify({'error': 'Uploaded file is empty'}), 400
+        
+        start_time = time.time()
+        colors, pages_rendered = sample_box_colors(pdf_data, boxes, scale, ring_width, method)
+        processing_time = time.time() - start_time
+        logger.info(f"Sampled {len(boxes)} box colours on {pages_rendered} pages in {processing_time:.2f} seconds")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        raise Exception(f"Failed to create temporary directory: {e}")
+        logger.error(f"Error sampling colours: {e}")
+        return jsonify({'error': f'Error processing PDF: {str(e)}'}), 500
     
-    try:
-        # Verify file exists
-        if not os.path.exists(pdf_path):
-            raise Exception(f"PDF file not found at: {pdf_path}")
+    result = []
+    for (page_num, coords), color in zip(boxes, colors):
+        red, green, blue = color or (1.0, 1.0, 1.0)  # White, as the editor defaults to
+        result.append({
+            'page': page_num + 1,
+            'bbox': {'x0': coords[0], 'y0': coords[1], 'x1': coords[2], 'y1': coords[3]},
+            'color': {'type': 'RGB', 'red': red, 'green': green, 'blue': blue},
+            'sampled': color is not None
+        })
+    
+    return jsonify({
+        'status': 'completed',
+        'method': method,
+        'pages_rendered': pages_rendered,
+        'processing_time': round(processing_time, 3),
+        'result': result
+    })
+
+def get_cover_page_image():
+    """The cover page PNG, read once"""
+    global cover_page_image
+    if cover_page_image is None:
+        with open(COVER_PAGE_PATH, 'rb') as f:
+            cover_page_image = f.read()
+    return cover_page_image
+
+def build_cover_pdf(width, height):
+    """The cover page at a page size as a one-page PDF, with the image decoded and embedded once per size"""
+    key = (round(width, 2), round(height, 2))
+    with cover_pdfs_lock:
+        if key in cover_pdfs:
+            cover_pdfs.move_to_end(key)
+            return cover_pdfs[key]
+    
+    cover = fitz.open()
+    page = cover.new_page(width=width, height=height)
+    page.insert_image(page.rect, stream=get_cover_page_image(), keep_proportion=False)
+    cover_pdf = cover.tobytes(garbage=3, deflate=True)
+    cover.close()
+    
+    with cover_pdfs_lock:
+        cover_pdfs[key] = cover_pdf
+        while len(cover_pdfs) > COVER_CACHE_SIZE:
+            cover_pdfs.popitem(last=False)
+    return cover_pdf
+
+def redact_pdf(pdf_source, boxes, fill='sample', add_cover=True):
+    """Redact boxes of a PDF, put the cover page in front and return the new PDF's bytes.
+
+    Everything happens on one open document: the fill colours are sampled
+    from its pages before any redaction is applied (or white with
+    fill='white'), each box grown by REDACT_PADDING is removed with a
+    redaction annotation in that colour, and the prebuilt cover page from
+    build_cover_pdf is inserted. The cover matches the first page's size,
+    or COVER_LANDSCAPE_SIZE for a landscape first page, as the editor lays
+    it out.
+    """
+    if isinstance(pdf_source, str):
+        pdf_document = fitz.open(pdf_source)
+    else:
+        pdf_document = fitz.open(stream=pdf_source, filetype="pdf")
+    
+    with pdf_document:
+        for page_num, _ in boxes:
+            if not 0 <= page_num < len(pdf_document):
+                raise ValueError(f"Page {page_num + 1} is out of range (the PDF has {len(pdf_document)} pages)")
         
-        # Open the PDF file with memory optimization
-        try:
-            pdf_document = fitz.open(pdf_path)
-            num_pages = len(pdf_document)
-            logger.info(f"Opened PDF with {num_pages} pages")
+        if fill == 'sample':
+            colors, _ = sample_document_colors(pdf_document, boxes)
+        else:
+            colors = [None] * len(boxes)
+        
+        redacted_pages = set()
+        for (page_num, coords), color in zip(boxes, colors):
+            page = pdf_document[page_num]
+            rect = fitz.Rect(coords) + (-REDACT_PADDING, -REDACT_PADDING, REDACT_PADDING, REDACT_PADDING)
+            page.add_redact_annot(rect, fill=color or (1, 1, 1))
+            redacted_pages.add(page_num)
+        
+        # One pass per page removes everything under its boxes at once
+        for page_num in sorted(redacted_pages):
+            pdf_document[page_num].apply_redactions()
+        
+        if add_cover:
+            width, height = pdf_document[0].rect.width, pdf_document[0].rect.height
+            if height < width:
+                width, height = COVER_LANDSCAPE_SIZE
+            # Copy the prebuilt cover page in as the new first page
+            with fitz.open(stream=build_cover_pdf(width, height), filetype="pdf") as cover_document:
+                pdf_document.insert_pdf(cover_document, from_page=0, to_page=0, start_at=0)
+        
+        return pdf_document.tobytes(garbage=3, deflate=True)
+
+@app.route('/process_pdf', methods=['POST'])
+def process_pdf():
+    """API endpoint to redact the QR codes of a PDF and add the cover page in one request.
+
+    Runs QR detection like /extract_qr (sharing its result cache and
+    admission control), fills every detected code plus any extra 'boxes'
+    (JSON, as for /sample_colors) with the surrounding colour ('fill':
+    'sample' or 'white'), inserts the cover page unless 'cover' is false and
+    sends the edited PDF back.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+    
+    try:
+        timeout = int(request.form.get('timeout', DEFAULT_TIMEOUT))
+    except ValueError:
+        timeout = DEFAULT_TIMEOUT
+    
+    backend = request.form.get('backend') or QR_BACKEND
+    if backend not in get_available_backends():
+        return jsonify({'error': f"Unknown or unavailable backend '{backend}'",
+                        'available_backends': get_available_backends()}), 400
+    
+    fill = request.form.get('fill', 'sample')
+    if fill not in ('sample', 'white'):
+        return jsonify({'error': f"Unknown fill '{fill}' (use 'sample' or 'white')"}), 400
+    add_cover = request.form.get('cover', 'true').lower() != 'false'
+    
+    try:
+        extra_boxes = parse_color_boxes(json.loads(request.form.get('boxes', '[]')))
+    except (ValueError, TypeError, KeyError) as e:
+        return jsonify({'error': f'Invalid boxes: {e}'}), 400
+    
+    job_id = str(uuid.uuid4())
+    admitted = False
+    
+    try:
+        pdf_data = read_upload(file)
+        if len(pdf_data) == 0:
+            return jsonify({'error': 'Uploaded file is empty'}), 400
+        
+        start_time = time.time()
+        cache_key = result_cache_key(pdf_data, backend)
+        qr_results = result_cache.get(cache_key)
+        
+        if qr_results is None:
+            client_id = request_client_id()
+            cost = estimate_job_cost(count_pdf_pages(pdf_data), len(pdf_data))
+            rejection = admission.admit(job_id, client_id, cost, len(pdf_data))
+            if rejection:
+                return overloaded_response(*rejection)
+            admitted = True
+            
+            with resource_lock:
+                job_schedules[job_id] = (client_id, PRIORITY_CLASSES['sync'], time.time())
+            
+            qr_results = process_pdf_with_timeout(pdf_data, job_id, timeout, cache_key=cache_key, backend=backend)
+        
+        boxes = [(qr['page'] - 1, [qr['bbox']['x1'], qr['bbox']['y1'], qr['bbox']['x2'], qr['bbox']['y2']])
+                 for qr in qr_results] + extra_boxes
+        output = redact_pdf(pdf_data, boxes, fill=fill, add_cover=add_cover)
+        
+        processing_time = time.time() - start_time
+        logger.info(f"Redacted {len(qr_results)} QR codes and {len(extra_boxes)} boxes of {file.filename} "
+                    f"in {processing_time:.2f} seconds")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error processing PDF: {e}")
+        return jsonify({'job_id': job_id, 'status': 'failed', 'error': f'Error processing PDF: {str(e)}'}), 500
+    finally:
+        if admitted:
+            admission.release(job_id)
+    
+    response = send_file(io.BytesIO(output), mimetype='application/pdf', as_attachment=True,
+                         download_name=file.filename or 'output.pdf')
+    response.headers['X-QR-Codes'] = str(len(qr_results))
+    response.headers['X-Processing-Time'] = f"{processing_time:.3f}"
+    return response
+
+def get_thread_detector(backend=None):
+    """Return this thread's detector backend (QR_BACKEND by default), creating it on first use"""
+    return qr_backends.thread_backend(backend or QR_BACKEND)
+
+def get_available_backends():
+    """Detector backends that can be created in this environment"""
+    global available_qr_backends
+    if available_qr_backends is None:
+        available_qr_backends = qr_backends.available_backends()
+    return available_qr_backends
+
+def pixmap_to_array(pix):
+    """Wrap a pixmap's sample buffer as a NumPy array without copying.
+
+    The array borrows the pixmap's memory, so the pixmap must stay referenced
+    for as long as the array is in use.
+    """
+    img = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    if pix.n == 1:
+        return img.reshape(pix.height, pix.width)
+    return img.reshape(pix.height, pix.width, pix.n)
+
+def track_render(pix):
+    """Record a pixmap's size as the current page task's peak if it is the largest so far"""
+    render_tracker.peak = max(getattr(render_tracker, 'peak', 0), pix.width * pix.height * pix.n)
+
+def record_stage(stage, seconds, rejected=False, calls=1):
+    """Add runs of a detection stage to the current page task's timings"""
+    stages = getattr(stage_tracker, 'stages', None)
+    if stages is None:
+        stages = stage_tracker.stages = {}
+    total_calls, total_seconds, rejections = stages.get(stage, (0, 0.0, 0))
+    stages[stage] = (total_calls + calls, total_seconds + seconds, rejections + int(rejected))
+
+def estimate_page_render_bytes(page):
+    """Upper bound on the pixmaps a page task holds at once: the whole page at the top of the DPI ladder.
+
+    With TILED_DETECTION, larger pages never take more than one untiled
+    render or TILE_WORKERS + 1 tiles, whichever is bigger.
+    """
+    scale = max(DPI_LADDER) / 72
+    channels = 1 if RENDER_MODE == 'gray' else 3
+    pixels = -(-page.rect.width * scale // 1) * -(-page.rect.height * scale // 1)
+    if TILED_DETECTION:
+        pixels = min(pixels, max(TILE_MAX_PIXELS, (TILE_WORKERS + 1) * TILE_SIZE * TILE_SIZE))
+    return int(pixels * channels)
+
+def load_page_image(page, dpi, temp_filename=None, clip=None):
+    """Render a page (or the clip rectangle of it) at the given DPI and return (pixmap, image array).
+
+    In the 'gray' RENDER_MODE the pixmap is single-channel luminance, a third
+    of the RGB size, which is all the detector looks at. Without a
+    temp_filename the image is a zero-copy view of the pixmap samples. With
+    one, the render is saved as PNG and read back with OpenCV (PIL as
+    fallback), which is only useful when debugging renders.
+    """
+    gray = RENDER_MODE == 'gray'
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi/72, dpi/72), colorspace=fitz.csGRAY if gray else fitz.csRGB,
+                          alpha=False, clip=clip)
+    track_render(pix)
+    
+    if temp_filename is None:
+        return pix, pixmap_to_array(pix)
+    
+    # Save the pixmap
+    pix.save(temp_filename)
+    
+    # Explicitly delete the pixmap to free memory
+    del pix
+    
+    # Check if the file was created
+    if not os.path.exists(temp_filename) or os.path.getsize(temp_filename) == 0:
+        raise Exception(f"Failed to create image file at {temp_filename}")
+    
+    # Read the image with OpenCV
+    img = cv2.imread(temp_filename, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
+    
+    if img is None:
+        # Try PIL as fallback
+        try:
+            from PIL import Image
+            pil_img = Image.open(temp_filename)
+            if gray:
+                img = np.array(pil_img.convert('L'))
+            else:
+                img = cv2.cvtColor(np.array(pil_img.convert('RGB')), cv2.COLOR_RGB2BGR)
+            del pil_img  # Free memory
+        except Exception as pil_err:
+            raise Exception(f"Failed to load image: {pil_err}")
+    
+    return None, img
+
+def downsample_for_detection(img):
+    """Area-average a render down to DETECT_MAX_PIXELS; returns (image, scale factor applied)"""
+    pixels = img.shape[0] * img.shape[1]
+    if not DETECT_MAX_PIXELS or pixels <= DETECT_MAX_PIXELS:
+        return img, 1.0
+    
+    factor = (DETECT_MAX_PIXELS / pixels) ** 0.5
+    return cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA), factor
+
+def cluster_small_paths(rects, page_rect):
+    """Group small filled paths into dense clusters, as drawn by vector QR codes.
+
+    The paths are stamped onto a coarse mask of the page, which is dilated so
+    neighbouring modules touch; each connected component holding enough paths
+    becomes a candidate region.
+    """
+    scale = 0.5  # Mask pixels per PDF point
+    mask_width = max(1, int(page_rect.width * scale) + 1)
+    mask_height = max(1, int(page_rect.height * scale) + 1)
+    mask = np.zeros((mask_height, mask_width), dtype=np.uint8)
+    
+    boxes = np.array([(r.x0, r.y0, r.x1, r.y1) for r in rects], dtype=np.float64)
+    boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - page_rect.x0) * scale, 0, mask_width - 1)
+    boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - page_rect.y0) * scale, 0, mask_height - 1)
+    boxes = boxes.astype(np.int32)
+    
+    for x0, y0, x1, y1 in boxes:
+        mask[y0:y1 + 1, x0:x1 + 1] = 1
+    
+    mask = cv2.dilate(mask, np.ones((3, 3), dtype=np.uint8))
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    
+    # Count the paths that fall into each component
+    centers_x = (boxes[:, 0] + boxes[:, 2]) // 2
+    centers_y = (boxes[:, 1] + boxes[:, 3]) // 2
+    path_counts = np.bincount(labels[centers_y, centers_x], minlength=num_labels)
+    
+    regions = []
+    for label in range(1, num_labels):
+        x, y, w, h = stats[label, :4]
+        if path_counts[label] < MIN_QR_MODULES or min(w, h) < MIN_QR_SIZE * scale:
+            continue
+        regions.append(fitz.Rect(x / scale, y / scale, (x + w) / scale, (y + h) / scale) + (page_rect.x0, page_rect.y0, page_rect.x0, page_rect.y0))
+    
+    return regions
+
+def merge_regions(regions, page_rect):
+    """Pad candidate regions and merge the ones that overlap"""
+    merged = []
+    for rect in regions:
+        rect = (fitz.Rect(rect) + (-REGION_PADDING, -REGION_PADDING, REGION_PADDING, REGION_PADDING)) & page_rect
+        if rect.is_empty:
+            continue
+        
+        # Absorb every existing region this one touches, repeating as it grows
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if rect.intersects(other):
+                    rect |= other
+                    merged.remove(other)
+                    overlapping = True
+                    break
+        merged.append(rect)
+    
+    return merged
+
+def find_candidate_regions(page, decoded_rects=()):
+    """Locate the areas of a page that could hold a QR code without rendering it.
+
+    QR codes in our PDFs are either raster images or dense groups of vector
+    paths. Images placed at decoded_rects were already decoded directly and
+    are left out. Returns a list of clip rectangles, [None] when the
+    candidates cover most of the page (render it whole), or [] when the page
+    has none.
+    """
+    page_rect = page.rect
+    candidates = []
+    
+    # Raster images large enough to hold a QR code
+    for info in page.get_image_info():
+        if info['width'] < MIN_QR_MODULES or info['height'] < MIN_QR_MODULES:
+            continue
+        rect = fitz.Rect(info['bbox'])
+        if any(max(abs(a - b) for a, b in zip(rect, decoded_rect)) < 1 for decoded_rect in decoded_rects):
+            continue
+        rect &= page_rect
+        if rect.width >= MIN_QR_SIZE and rect.height >= MIN_QR_SIZE:
+            candidates.append(rect)
+    
+    # Vector QR codes are either one path with many module rectangles, or many small paths
+    small_paths = []
+    for drawing in page.get_drawings():
+        rect = drawing['rect']
+        if rect.is_empty or rect.is_infinite:
+            continue
+        if len(drawing['items']) >= MIN_QR_MODULES and min(rect.width, rect.height) >= MIN_QR_SIZE:
+            candidates.append(rect & page_rect)
+        elif drawing.get('fill') is not None and max(rect.width, rect.height) <= MIN_QR_SIZE:
+            small_paths.append(rect)
+    
+    if len(small_paths) >= MIN_QR_MODULES:
+        candidates.extend(cluster_small_paths(small_paths, page_rect))
+    
+    regions = merge_regions(candidates, page_rect)
+    if sum(rect.width * rect.height for rect in regions) > FULL_PAGE_REGION_FRACTION * page_rect.width * page_rect.height:
+        return [None]
+    return regions
+
+def build_qr_info(page_num, qr_points, data, region_rect, img_shape):
+    """Convert a detection in a rendered region back to PDF page coordinates"""
+    # Image dimensions
+    img_height, img_width = img_shape[:2]
+    
+    # Scale factors to convert image coordinates to PDF coordinates
+    scale_x = region_rect.width / img_width
+    scale_y = region_rect.height / img_height
+    
+    # Convert to a four-point array if needed
+    qr_points = qr_points.astype(int)
+    
+    # Convert polygon coordinates to PDF coordinates
+    pdf_points = [
+        (int(region_rect.x0 + p[0] * scale_x), int(region_rect.y0 + p[1] * scale_y)) for p in qr_points
+    ]
+    
+    return make_qr_info(page_num, pdf_points, data)
+
+def make_qr_info(page_num, pdf_points, data):
+    """Build the result dict for a QR code from its polygon in PDF coordinates"""
+    # Calculate bounding box in PDF coordinates
+    x_values = [p[0] for p in pdf_points]
+    y_values = [p[1] for p in pdf_points]
+    
+    min_x, max_x = min(x_values), max(x_values)
+    min_y, max_y = min(y_values), max(y_values)
+    
+    # Store QR code information
+    return {
+        'page': page_num + 1,  # 1-based page number
+        'polygon': pdf_points,
+        'bbox': {
+            'x1': min_x,
+            'y1': min_y,
+            'x2': max_x,
+            'y2': max_y,
+            'width': max_x - min_x,
+            'height': max_y - min_y
+        },
+        'center': {
+            'x': (min_x + max_x) / 2,
+            'y': (min_y + max_y) / 2
+        },
+        'data': data
+    }
+
+def result_rect(qr):
+    """A result's bbox as a PDF rectangle"""
+    return fitz.Rect(qr['bbox']['x1'], qr['bbox']['y1'], qr['bbox']['x2'], qr['bbox']['y2'])
+
+def bbox_iou(a, b):
+    """Intersection over union of two result bboxes"""
+    overlap_x = max(0, min(a['x2'], b['x2']) - max(a['x1'], b['x1']))
+    overlap_y = max(0, min(a['y2'], b['y2']) - max(a['y1'], b['y1']))
+    overlap_area = overlap_x * overlap_y
+    union_area = a['width'] * a['height'] + b['width'] * b['height'] - overlap_area
+    return overlap_area / union_area if union_area > 0 else 0
+
+def deduplicate_results(results, min_iou=0.5):
+    """Drop detections of the same code found twice (same page, same data, overlapping boxes)"""
+    unique = []
+    for qr in results:
+        if not any(qr['page'] == kept['page'] and qr['data'] == kept['data']
+                   and bbox_iou(qr['bbox'], kept['bbox']) >= min_iou for kept in unique):
+            unique.append(qr)
+    return unique
+
+def decode_image_xref(document, xref, qr_detector):
+    """Detect QR codes in an embedded image at its native resolution.
+
+    Returns [(points, data)] with points as fractions of the image width and
+    height, so they can be mapped through any placement of the image.
+    """
+    pix = fitz.Pixmap(document, xref)
+    track_render(pix)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.n != 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+    img = pixmap_to_array(pix)
+    
+    # Tiny images are upscaled so each module spans a few pixels
+    scale = max(1, DIRECT_DECODE_MIN_SIDE / min(img.shape))
+    if scale > 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    
+    detections = cascade_detect(qr_detector, img)
+    
+    # Like the page render retry, give small images a second chance at twice the size
+    if not detections and max(img.shape) < DIRECT_DECODE_RETRY_BELOW:
+        img = cv2.resize(img, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        detections = cascade_detect(qr_detector, img)
+    
+    img_height, img_width = img.shape[:2]
+    codes = [(qr_points / (img_width, img_height), data) for qr_points, data in detections]
+    
+    del img, pix
+    return codes
+
+def decode_page_images(page, page_num, qr_detector, image_results):
+    """Find QR codes in the page's embedded images without rendering the page.
+
+    Each image xref is decoded once per document (memoized in image_results)
+    and its codes are mapped through every placement of the image on the page.
+    Returns (results, placement rects of the decoded images).
+    """
+    page_results = []
+    decoded_rects = []
+    page_rect = page.rect
+    
+    # An image referenced under several names is still one set of placements
+    images = {image[0]: image for image in page.get_images(full=True)}
+    
+    for xref, image in images.items():
+        # (xref, smask, width, height, ...)
+        width, height = image[2], image[3]
+        if width < MIN_QR_MODULES or height < MIN_QR_MODULES:
+            continue
+        
+        if xref not in image_results:
+            try:
+                image_results[xref] = decode_image_xref(page.parent, xref, qr_detector)
+            except Exception as e:
+                logger.warning(f"Could not decode image {xref} on page {page_num + 1}: {e}")
+                image_results[xref] = None
+        
+        if image_results[xref] is None:
+            continue  # Left to the render path
+        
+        for placement_rect, matrix in page.get_image_rects(xref, transform=True):
+            decoded_rects.append(placement_rect)
+            
+            for unit_points, data in image_results[xref]:
+                pdf_points = [fitz.Point(float(x), float(y)) * matrix for x, y in unit_points]
+                
+                # Codes in parts of the image that fall outside the page are not visible
+                center = fitz.Point(sum(p.x for p in pdf_points) / 4, sum(p.y for p in pdf_points) / 4)
+                if not page_rect.contains(center):
+                    continue
+                
+                page_results.append(make_qr_info(page_num, [(int(p.x), int(p.y)) for p in pdf_points], data))
+    
+    return page_results, decoded_rects
+
+def count_finder_patterns(img):
+    """Count finder-pattern candidates in an image (see qr_shapes), scanning every PREFILTER_SCAN_STEP-th line"""
+    return qr_shapes.count_finder_patterns(img, PREFILTER_SCAN_STEP)
+
+def cascade_detect(qr_detector, img):
+    """Run the detector on an image unless the finder-pattern prefilter rules it out"""
+    if FINDER_PREFILTER:
+        start = time.perf_counter()
+        passed = count_finder_patterns(img) >= PREFILTER_MIN_FINDERS
+        record_stage('prefilter', time.perf_counter() - start, rejected=not passed)
+        if not passed:
+            return []
+    
+    start = time.perf_counter()
+    detections = qr_detector.detect(img)
+    record_stage('detect', time.perf_counter() - start)
+    return detections
+
+def find_qr_candidates(img, dpi):
+    """Find blobs in a render that could be QR codes, as (x, y, w, h) pixel rects.
+
+    Modules are joined by a morphological close, so a code shows up as a
+    square blob that is roughly half dark even when its finder patterns are
+    too small to resolve at this DPI.
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    
+    kernel_size = max(3, int(round(2 * dpi / 72)))
+    closed = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones((kernel_size, kernel_size), dtype=np.uint8))
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.empty((0, 4), dtype=np.int32)
+    
+    rects = np.array([cv2.boundingRect(contour) for contour in contours], dtype=np.int32)
+    x, y, w, h = rects.T
+    
+    # Dark pixel density of every rect at once from the integral image
+    integral = cv2.integral(binary)
+    dark = (integral[y + h, x + w] - integral[y, x + w] - integral[y + h, x] + integral[y, x]).astype(np.float64)
+    density = dark / np.maximum(1, w * h)
+    
+    min_side = 0.8 * MIN_QR_SIZE * dpi / 72
+    keep = ((np.minimum(w, h) >= min_side) &
+            (w <= 1.4 * h) & (h <= 1.4 * w) &
+            (density >= 0.2) & (density <= 0.8) &
+            (np.maximum(w, h) < 0.9 * min(gray.shape)))
+    return rects[keep]
+
+def scan_render(page_num, img, rect, dpi, qr_detector, find_candidates=True):
+    """Detect QR codes in a render of the page rectangle rect at dpi.
+
+    Returns (decoded, undecoded, candidates): decoded and undecoded results
+    in page coordinates and, if find_candidates is set, the page rects of
+    QR-like blobs worth refining at a higher DPI.
+    """
+    decoded = []
+    undecoded = []
+    for qr_points, data in cascade_detect(qr_detector, img):
+        qr_info = build_qr_info(page_num, qr_points, data or "Unable to decode", rect, img.shape)
+        (decoded if data else undecoded).append(qr_info)
+    
+    candidates = []
+    if find_candidates:
+        scale = 72 / dpi
+        start = time.perf_counter()
+        for x, y, w, h in find_qr_candidates(img, dpi):
+            candidates.append(fitz.Rect(rect.x0 + x * scale, rect.y0 + y * scale,
+                                        rect.x0 + (x + w) * scale, rect.y0 + (y + h) * scale))
+        record_stage('candidates', time.perf_counter() - start)
+    
+    return decoded, undecoded, candidates
+
+def needs_tiles(rect, dpi):
+    """Whether a page rectangle rendered at dpi is too large to detect in one piece"""
+    return TILED_DETECTION and rect.width * rect.height * (dpi / 72) ** 2 > TILE_MAX_PIXELS
+
+def tile_spans(start, end, side, overlap):
+    """Evenly spaced spans of length side covering [start, end], overlapping by at least overlap"""
+    if end - start <= side:
+        return [(start, end)]
+    count = -(-(end - start - overlap) // (side - overlap))
+    step = (end - start - side) / (count - 1)
+    return [(start + i * step, start + i * step + side) for i in range(int(count))]
+
+def tile_rects(rect, dpi):
+    """Split a page rectangle into overlapping tiles of at most TILE_SIZE pixels a side at dpi"""
+    side = TILE_SIZE * 72 / dpi
+    overlap = side * TILE_OVERLAP
+    return [fitz.Rect(x0, y0, x1, y1)
+            for y0, y1 in tile_spans(rect.y0, rect.y1, side, overlap)
+            for x0, x1 in tile_spans(rect.x0, rect.x1, side, overlap)]
+
+def get_tile_executor():
+    """Return this process's tile thread pool, starting it on first use"""
+    global tile_executor
+    with tile_executor_lock:
+        if tile_executor is None:
+            tile_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix='tile')
+        return tile_executor
+
+def scan_tile(backend, page_num, img, rect, dpi, find_candidates):
+    """scan_render on a tile thread; also returns the stage timings recorded there"""
+    stage_tracker.stages = {}
+    scanned = scan_render(page_num, img, rect, dpi, qr_backends.thread_backend(backend), find_candidates)
+    return scanned + (stage_tracker.stages,)
+
+def detect_in_tiles(page, page_num, rect, dpi, qr_detector, find_candidates=True, temp_prefix=None):
+    """scan_render for a page rectangle too large to render whole, in overlapping tiles.
+
+    Tiles are rendered one after another on this thread, which owns the
+    page, while up to TILE_WORKERS earlier tiles are scanned on the tile
+    threads, so at most TILE_WORKERS + 1 tile pixmaps exist at once whatever
+    the page size. Codes smaller than the overlap are seen whole in some
+    tile; the copies are merged by data and IoU, and undecoded fragments of
+    codes decoded in a neighbouring tile are dropped.
+    """
+    executor = get_tile_executor()
+    tiles = tile_rects(rect, dpi)
+    in_flight = deque()  # (pixmap, image bytes, future) of tiles being scanned
+    decoded = []
+    undecoded = []
+    candidates = []
+    
+    def collect():
+        _, _, future = in_flight.popleft()
+        tile_decoded, tile_undecoded, tile_candidates, stages = future.result()
+        for stage, (calls, seconds, rejected) in stages.items():
+            record_stage(stage, seconds, rejected, calls)
+        decoded.extend(tile_decoded)
+        undecoded.extend(tile_undecoded)
+        candidates.extend(tile_candidates)
+    
+    logger.info(f"Scanning page {page_num + 1} at {dpi} DPI in {len(tiles)} tiles")
+    
+    for tile_num, tile in enumerate(tiles):
+        while len(in_flight) > TILE_WORKERS:
+            collect()
+        
+        temp_filename = f"{temp_prefix}_tile_{tile_num}.png" if temp_prefix else None
+        start = time.perf_counter()
+        pix, img = load_page_image(page, dpi, temp_filename, tile)
+        img, factor = downsample_for_detection(img)
+        record_stage('render', time.perf_counter() - start)
+        
+        # The pixmap is kept until the scan is collected, since the image may borrow its buffer
+        future = executor.submit(scan_tile, qr_detector.name, page_num, img, tile, dpi * factor, find_candidates)
+        in_flight.append((pix, img.nbytes, future))
+        render_tracker.peak = max(getattr(render_tracker, 'peak', 0), sum(nbytes for _, nbytes, _ in in_flight))
+        del img, pix
+    
+    while in_flight:
+        collect()
+    
+    decoded = deduplicate_results(decoded)
+    undecoded = [qr for qr in deduplicate_results(undecoded)
+                 if not any(result_rect(qr).intersects(result_rect(kept)) for kept in decoded)]
+    return decoded, undecoded, candidates
+
+def detect_in_region(page, page_num, clip, qr_detector, temp_prefix=None):
+    """Detect QR codes in a page region (the whole page when clip is None) up the DPI ladder.
+
+    The region is rendered at the first rung. Codes that decode there are
+    kept; undecoded detections and QR-like blobs become ROIs that are
+    re-rendered, clipped, at the next rung, and so on. A prepass clip where
+    nothing at all was seen is carried up whole, since the prepass already
+    found something there. Renders larger than TILE_MAX_PIXELS are scanned
+    in tiles.
+    """
+    region_results = []
+    region_rect = clip if clip is not None else page.rect
+    pending = [clip]
+    
+    for rung, dpi in enumerate(DPI_LADDER):
+        last_rung = rung == len(DPI_LADDER) - 1
+        next_rois = []
+        
+        for roi_num, roi in enumerate(pending):
+            roi_rect = roi if roi is not None else page.rect
+            roi_prefix = f"{temp_prefix}_{dpi}_{roi_num}" if temp_prefix else None
+            
+            if needs_tiles(roi_rect, dpi):
+                decoded, undecoded, candidates = detect_in_tiles(page, page_num, roi_rect, dpi, qr_detector,
+                                                                 not last_rung, roi_prefix)
+            else:
+                start = time.perf_counter()
+                pix, img = load_page_image(page, dpi, f"{roi_prefix}.png" if roi_prefix else None, roi)
+                img, factor = downsample_for_detection(img)
+                record_stage('render', time.perf_counter() - start)
+                
+                decoded, undecoded, candidates = scan_render(page_num, img, roi_rect, dpi * factor, qr_detector,
+                                                             not last_rung)
+                
+                # Free memory (the image borrows the pixmap's buffer)
+                del img, pix
+            
+            if last_rung:
+                # Nothing left to refine, so undecoded detections are reported as before
+                region_results.extend(decoded + undecoded)
+            else:
+                region_results.extend(decoded)
+                
+                # Blobs that are codes we already decoded need no refinement
+                rois = [result_rect(qr) for qr in undecoded]
+                rois.extend(rect for rect in candidates
+                            if not any(rect.intersects(result_rect(qr)) for qr in decoded))
+                
+                if rois:
+                    next_rois.extend(rois)
+                elif not decoded and roi is not None:
+                    next_rois.append(roi)
+        
+        if not next_rois:
+            break
+        
+        pending = merge_regions(next_rois, region_rect)
+        
+        # Many scattered ROIs are cheaper to render as the one region
+        if sum(rect.width * rect.height for rect in pending) > FULL_PAGE_REGION_FRACTION * region_rect.width * region_rect.height:
+            pending = [clip]
+        
+        logger.info(f"Refining {len(pending)} regions of page {page_num + 1} at {DPI_LADDER[rung + 1]} DPI")
+    
+    return region_results
+
+def process_page(page_info, temp_dir=None, qr_detector=None, image_results=None):
+    """Process a single PDF page to extract QR codes.
+
+    With DIRECT_IMAGE_DECODE, embedded images are decoded at native
+    resolution (memoized per document in image_results). With VECTOR_PREPASS,
+    pages without other candidate images or drawings are then skipped and
+    only the candidate regions are rendered. Pages are rendered in memory
+    unless a temp_dir is given, in which case renders are written there as
+    PNG files for debugging.
+    """
+    page_num, page, page_width, page_height = page_info
+    page_results = []
+    
+    try:
+        # Make sure temp directory exists
+        if temp_dir:
+            os.makedirs(temp_dir, exist_ok=True)
+        
+        if qr_detector is None:
+            qr_detector = get_thread_detector()
+        
+        # Embedded images are decoded directly instead of being rendered
+        decoded_rects = []
+        if DIRECT_IMAGE_DECODE:
+            if image_results is None:
+                image_results = {}
+            page_results, decoded_rects = decode_page_images(page, page_num, qr_detector, image_results)
+        
+        regions = find_candidate_regions(page, decoded_rects) if VECTOR_PREPASS else [None]
+        if not regions:
+            logger.info(f"No regions left to render on page {page_num + 1}")
+        
+        for region_num, clip in enumerate(regions):
+            # Only debug mode writes renders to disk (removed with the job's temp_dir)
+            temp_prefix = os.path.join(temp_dir, f"page_{page_num}_{region_num}") if temp_dir else None
+            page_results.extend(detect_in_region(page, page_num, clip, qr_detector, temp_prefix))
+        
+        page_results = deduplicate_results(page_results)
+    
+    except Exception as e:
+        logger.error(f"Error processing page {page_num + 1}: {e}")
+        raise
+    
+    finally:
+        # Force garbage collection to free memory
+        gc.collect()
+    
+    return page_results
+
+def process_page_budgeted(page_info, temp_dir=None, qr_detector=None, image_results=None, backend=None,
+                          stage_stats=None):
+    """process_page for the thread engine, holding the page's reservation in the pixmap budget.
+
+    The page's detection stage timings are added to stage_stats, if given.
+    """
+    if qr_detector is None:
+        qr_detector = get_thread_detector(backend)
+    
+    with pixmap_budget.reserve(estimate_page_render_bytes(page_info[1])):
+        render_tracker.peak = 0
+        stage_tracker.stages = {}
+        try:
+            page_results = process_page(page_info, temp_dir, qr_detector, image_results)
+        finally:
+            merge_stage_timings(stage_tracker.stages, stage_stats)
+        pixmap_budget.record_used(render_tracker.peak)
+    return page_results
+
+def process_page_batch(page_batch, temp_dir, job_id, failed_pages=None, image_results=None, on_page=None,
+                       cancel_event=None, backend=None, stage_stats=None):
+    """Process a batch of pages and return combined results, stopping early once cancelled"""
+    batch_results = []
+    qr_detector = get_thread_detector(backend)  # Created once per thread and reused
+    
+    logger.info(f"Processing batch of {len(page_batch)} pages for job {job_id}")
+    
+    for page_info in page_batch:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        
+        try:
+            # Process page with shared detector
+            page_results = process_page_budgeted(page_info, temp_dir, qr_detector, image_results,
+                                                 stage_stats=stage_stats)
+            batch_results.extend(page_results)
+            
+            # Update processed page count
+            with resource_lock:
+                system_stats['processed_pages'] += 1
+            
+            if on_page:
+                on_page(page_info[0], page_results)
+                
+        except Exception as e:
+            logger.error(f"Error in batch processing page {page_info[0] + 1}: {e}")
+            if failed_pages is not None:
+                failed_pages.append(page_info[0])
+            if on_page:
+                on_page(page_info[0], None, str(e))
+            # Continue processing other pages despite errors
+    
+    return batch_results
+
+def init_page_worker():
+    """One-time setup of a warm worker process"""
+    # Ctrl+C is handled by the parent, which owns the worker lifecycle
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    cv2.setNumThreads(WORKER_CV_THREADS)
+    
+    # Other backends are created when a task first asks for them
+    qr_backends.thread_backend(QR_BACKEND)
+
+def page_worker_main(conn):
+    """Serve page tasks sent by the parent until the connection closes"""
+    init_page_worker()
+    
+    while True:
+        try:
+            func, args = conn.recv()
+        except (EOFError, OSError):
+            break
+        
+        try:
+            reply = ('ok', func(*args))
+        except Exception as e:
+            reply = ('error', f"{type(e).__name__}: {e}")
+        
+        try:
+            conn.send(reply)
+        except (EOFError, OSError):
+            # BrokenPipeError: the parent stopped waiting (shutdown or a cancelled job)
+            break
+
+class PixmapBudget:
+    """Byte budget for the pixmaps of all page tasks running at once.
+
+    Page tasks reserve their estimated peak pixmap size before they start,
+    and wait while the budget is exhausted. A task larger than the whole
+    budget is let through once nothing else is reserved. Reservations are
+    held in the parent process (for worker tasks, by the thread feeding the
+    worker), so a killed worker can never leak one.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.condition = threading.Condition()
+        self.reserved = 0
+        self.peak_reserved = 0
+        self.total_reserved = 0
+        self.total_used = 0
+        self.peak_used = 0
+        self.tasks = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+    
+    @contextmanager
+    def reserve(self, nbytes):
+        """Hold nbytes of the budget for the duration of the block"""
+        with self.condition:
+            if self.reserved and self.reserved + nbytes > self.max_bytes:
+                self.waits += 1
+                wait_start = time.time()
+                while self.reserved and self.reserved + nbytes > self.max_bytes:
+                    self.condition.wait()
+                self.wait_seconds += time.time() - wait_start
+            
+            self.reserved += nbytes
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+            self.total_reserved += nbytes
+            self.tasks += 1
+        
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.reserved -= nbytes
+                self.condition.notify_all()
+    
+    def record_used(self, nbytes):
+        """Record the largest pixmap a finished task actually rendered"""
+        with self.condition:
+            self.total_used += nbytes
+            self.peak_used = max(self.peak_used, nbytes)
+    
+    def stats(self):
+        with self.condition:
+            return {
+                'max_bytes': self.max_bytes,
+                'reserved_bytes': self.reserved,
+                'peak_reserved_bytes': self.peak_reserved,
+                'total_reserved_bytes': self.total_reserved,
+                'total_used_bytes': self.total_used,
+                'peak_used_bytes': self.peak_used,
+                'tasks': self.tasks,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3)
+            }
+
+pixmap_budget = PixmapBudget(PIXMAP_BUDGET_BYTES)
+
+class StageStats:
+    """Calls, time and prefilter rejections per detection stage, summed over page tasks"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+    
+    def merge(self, stages):
+        """Add the stage timings of a finished page task"""
+        with self.lock:
+            for stage, (calls, seconds, rejected) in stages.items():
+                total_calls, total_seconds, total_rejected = self.stages.get(stage, (0, 0.0, 0))
+                self.stages[stage] = (total_calls + calls, total_seconds + seconds, total_rejected + rejected)
+    
+    def stats(self):
+        with self.lock:
+            return {
+                stage: {
+                    'calls': calls,
+                    'seconds': round(seconds, 3),
+                    'avg_ms': round(seconds * 1000 / calls, 2) if calls else 0,
+                    'rejected': rejected,
+                    'rejection_rate': round(rejected / calls, 3) if calls else 0
+                }
+                for stage, (calls, seconds, rejected) in self.stages.items()
+            }
+
+detection_stages = StageStats()
+
+def merge_stage_timings(stages, stage_stats=None):
+    """Add a page task's stage timings to the process-wide totals and the job's (stage_stats)"""
+    detection_stages.merge(stages)
+    if stage_stats is not None:
+        stage_stats.merge(stages)
+
+class PageScheduler:
+    """Queue of page tasks from every job, handed out fairly.
+
+    Tasks of the most urgent priority class go first (sync requests before
+    async jobs). Within a class clients take turns, and each client's job
+    with the fewest pages goes first, so a one-page request never waits for
+    all of a long catalogue, only for the tasks already running.
+    """
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.classes = {}  # priority -> OrderedDict of client_id -> {job_id: queued job}
+        self.queued = 0
+        self.releases = {}  # worker_num -> documents the worker should close before its next task
+    
+    def put(self, task, job_id=None, pages=1):
+        """Queue a task for job_id; pages is the job's size, its shortest-job-first hint.
+
+        Returns False, queuing nothing, if the job has already been cancelled.
+        """
+        with resource_lock:
+            client_id, priority, _ = job_schedules.get(job_id, ('local', PRIORITY_CLASSES['sync'], None))
+        
+        with self.condition:
+            # Checked under the condition, so cancel() can't run between this and the append
+            if is_job_cancelled(job_id):
+                return False
+            
+            clients = self.classes.setdefault(priority, OrderedDict())
+            jobs = clients.setdefault(client_id, {})
+            if job_id not in jobs:
+                jobs[job_id] = {'pages': pages, 'order': next(job_sequence), 'tasks': deque()}
+            jobs[job_id]['tasks'].append(task)
+            self.queued += 1
+            self.condition.notify()
+        return True
+    
+    def cancel(self, job_id):
+        """Drop a job's queued tasks and return them"""
+        removed = []
+        with self.condition:
+            for clients in self.classes.values():
+                for client_id in list(clients):
+                    job = clients[client_id].pop(job_id, None)
+                    if job is None:
+                        continue
+                    removed.extend(job['tasks'])
+                    if not clients[client_id]:
+                        del clients[client_id]
+            self.queued -= len(removed)
+        return removed
+    
+    def release(self, worker_nums, pdf_ref):
+        """Ask the given workers to close pdf_ref, ahead of any queued task"""
+        with self.condition:
+            for worker_num in worker_nums:
+                self.releases.setdefault(worker_num, []).append(pdf_ref)
+            self.condition.notify_all()
+    
+    def get(self, worker_num=None):
+        """Block until there is work for a worker and return it.
+
+        Returns ('release', pdf_ref) for a document the worker should close,
+        otherwise ('task', task) with the next task in fair order.
+        """
+        with self.condition:
+            while not self.queued and not self.releases.get(worker_num):
+                self.condition.wait()
+            
+            if self.releases.get(worker_num):
+                return 'release', self.releases[worker_num].pop(0)
+            
+            clients = self.classes[min(priority for priority, clients in self.classes.items() if clients)]
+            client_id = next(iter(clients))
+            clients.move_to_end(client_id)  # The next task goes to another client
+            
+            jobs = clients[client_id]
+            job_id = min(jobs, key=lambda queued_job: (jobs[queued_job]['pages'], jobs[queued_job]['order']))
+            tasks = jobs[job_id]['tasks']
+            task = tasks.popleft()
+            
+            if not tasks:
+                del jobs[job_id]
+                if not jobs:
+                    del clients[client_id]
+            self.queued -= 1
+            return 'task', task
+    
+    def stats(self):
+        """Queued tasks per priority class and clients waiting"""
+        with self.condition:
+            queued_by_class = {}
+            waiting_clients = set()
+            for name, priority in PRIORITY_CLASSES.items():
+                clients = self.classes.get(priority, {})
+                queued_by_class[name] = sum(len(job['tasks']) for jobs in clients.values() for job in jobs.values())
+                waiting_clients.update(clients)
+            
+            return {
+                'queued_tasks': self.queued,
+                'queued_by_class': queued_by_class,
+                'waiting_clients': len(waiting_clients)
+            }
+
+class PageWorkerPool:
+    """Long-lived worker processes that serve page tasks from every job.
+
+    Each worker is fed by a dedicated thread in the parent, which hands it one
+    task at a time from the shared PageScheduler and respawns the process if
+    it dies.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self.tasks = PageScheduler()
+        self.threads = []
+        self.lock = threading.Lock()
+        self.processes = [None] * size
+        self.running_jobs = [None] * size  # job_id of the task each worker is running
+        self.documents = [set() for _ in range(size)]  # Documents each worker has opened for page tasks
+        self.killed = [False] * size
+        
+        for worker_num in range(size):
+            thread = threading.Thread(target=self._serve, args=(worker_num,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def submit(self, func, *args, job_id=None, pages=1, reserve_bytes=0, document=None):
+        """Queue func(*args) for a worker process and return a Future.
+
+        reserve_bytes is held in the pixmap budget while the task runs.
+        document is the pdf_ref the task opens in its worker, closed there
+        by release_document().
+        """
+        future = concurrent.futures.Future()
+        if not self.tasks.put((future, func, args, job_id, reserve_bytes, document), job_id, pages):
+            # The job is already cancelled: the task never reaches a worker or the pixmap budget
+            future.cancel()
+            future.set_running_or_notify_cancel()
+        return future
+    
+    def cancel_job(self, job_id):
+        """Cancel a job's queued tasks and kill the workers running its tasks.
+
+        Killed workers are respawned by their serving threads. Returns the
+        number of tasks cancelled or interrupted.
+        """
+        cancelled = 0
+        for future, *_ in self.tasks.cancel(job_id):
+            # Notifying the cancellation wakes up as_completed() in the job's thread
+            if future.cancel():
+                future.set_running_or_notify_cancel()
+            cancelled += 1
+        
+        with self.lock:
+            for worker_num, running_job in enumerate(self.running_jobs):
+                if running_job == job_id and not self.killed[worker_num]:
+                    logger.info(f"Killing page worker {worker_num + 1} (pid {self.processes[worker_num].pid}) for cancelled job {job_id}")
+                    self.processes[worker_num].terminate()
+                    self.killed[worker_num] = True
+                    cancelled += 1
+        
+        return cancelled
+    
+    def release_document(self, pdf_ref):
+        """Have every worker that opened pdf_ref for a finished job close its copy.
+
+        Workers close it before their next task, or right away when idle.
+        """
+        with self.lock:
+            worker_nums = [worker_num for worker_num, documents in enumerate(self.documents) if pdf_ref in documents]
+            for worker_num in worker_nums:
+                self.documents[worker_num].discard(pdf_ref)
+        
+        if worker_nums:
+            self.tasks.release(worker_nums, pdf_ref)
+    
+    def _spawn(self):
+        parent_conn, child_conn = mp_context.Pipe()
+        process = mp_context.Process(target=page_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+    
+    def _respawn(self, worker_num, process, conn):
+        """Replace a dead or killed worker with a fresh process and return (process, conn)"""
+        conn.close()
+        process.join(timeout=1)
+        process, conn = self._spawn()
+        with self.lock:
+            self.processes[worker_num] = process
+            self.documents[worker_num].clear()
+        return process, conn
+    
+    def _serve(self, worker_num):
+        process, conn = self._spawn()
+        self.processes[worker_num] = process
+        logger.info(f"Started page worker {worker_num + 1} (pid {process.pid})")
+        
+        while True:
+            kind, item = self.tasks.get(worker_num)
+            if kind == 'release':
+                try:
+                    conn.send((close_worker_document, (item,)))
+                    conn.recv()
+                except (EOFError, OSError) as e:
+                    # Respawned now, so the next task (maybe another job's) gets a live worker
+                    logger.warning(f"Page worker {worker_num + 1} (pid {process.pid}) died: {e}, respawning")
+                    process, conn = self._respawn(worker_num, process, conn)
+                continue
+            
+            future, func, args, job_id, reserve_bytes, document = item
+            
+            with pixmap_budget.reserve(reserve_bytes):
+                # The job may have been cancelled while this task waited for the budget
+                if is_job_cancelled(job_id):
+                    future.cancel()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                
+                with self.lock:
+                    self.running_jobs[worker_num] = job_id
+                    if document is not None:
+                        self.documents[worker_num].add(document)
+                
+                try:
+                    conn.send((func, args))
+                    status, data = conn.recv()
+                except (EOFError, OSError) as e:
+                    status, data = 'died', e
+            
+            with self.lock:
+                self.running_jobs[worker_num] = None
+                killed = self.killed[worker_num]
+                self.killed[worker_num] = False
+            
+            if status == 'died' or killed:
+                if killed:
+                    future.set_exception(Exception(f"Job {job_id} was cancelled"))
+                else:
+                    future.set_exception(Exception(f"Page worker {worker_num + 1} died: {data}"))
+                    logger.warning(f"Page worker {worker_num + 1} (pid {process.pid}) died, respawning")
+                process, conn = self._respawn(worker_num, process, conn)
+                continue
+            
+            if status == 'ok':
+                future.set_result(data)
+            else:
+                future.set_exception(Exception(data))
+
+def start_page_worker_pool(size=None):
+    """Start the shared pool of warm page workers if it isn't running yet"""
+    global page_worker_pool
+    
+    with page_worker_pool_lock:
+        if page_worker_pool is None:
+            size = max(1, size or PROCESS_POOL_SIZE or WORKER_POOL_SIZE or 1)
+            page_worker_pool = PageWorkerPool(size)
+            logger.info(f"Started {size} warm page workers")
+    
+    return page_worker_pool
+
+@contextmanager
+def shared_pdf_source(pdf_source):
+    """Yield a picklable reference to a PDF for worker processes.
+
+    Paths are passed as-is; bytes are placed in shared memory once per job
+    instead of being pickled into every task.
+    """
+    if isinstance(pdf_source, str):
+        # The modification time keeps workers from reusing a stale copy
+        yield ('path', pdf_source, os.stat(pdf_source).st_mtime_ns)
+        return
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(pdf_source)))
+    try:
+        shm.buf[:len(pdf_source)] = pdf_source
+        yield ('shm', shm.name, len(pdf_source))
+    finally:
+        shm.close()
+        shm.unlink()
+
+def open_worker_document(pdf_ref):
+    """Open a PDF in a worker process, reusing it across the job's page tasks"""
+    if pdf_ref in worker_documents:
+        worker_documents.move_to_end(pdf_ref)
+        return worker_documents[pdf_ref]
+    
+    if pdf_ref[0] == 'path':
+        document = fitz.open(pdf_ref[1])
+    else:
+        shm = shared_memory.SharedMemory(name=pdf_ref[1])
+        try:
+            document = fitz.open(stream=bytes(shm.buf[:pdf_ref[2]]), filetype="pdf")
+        finally:
+            shm.close()
+    
+    worker_documents[pdf_ref] = document
+    worker_image_results[pdf_ref] = {}
+    while len(worker_documents) > WORKER_OPEN_DOCUMENTS:
+        stale_ref, stale_document = worker_documents.popitem(last=False)
+        worker_image_results.pop(stale_ref, None)
+        stale_document.close()
+    
+    return document
+
+def close_worker_document(pdf_ref):
+    """Drop a finished job's PDF from a worker's open documents"""
+    document = worker_documents.pop(pdf_ref, None)
+    worker_image_results.pop(pdf_ref, None)
+    if document is not None:
+        document.close()
+
+def process_page_group(pdf_ref, page_nums, backend=None):
+    """Process a group of pages in a worker process.
+
+    Returns (page_nums, results, errors, peak pixmap bytes, stage timings)
+    so the parent can account for every page without shipping PyMuPDF
+    objects between processes.
+    """
+    results = []
+    errors = []
+    document = open_worker_document(pdf_ref)
+    backend = backend or QR_BACKEND
+    qr_detector = qr_backends.thread_backend(backend)
+    image_results = worker_image_results[pdf_ref].setdefault(backend, {})
+    render_tracker.peak = 0
+    stage_tracker.stages = {}
+    
+    for page_num in page_nums:
+        try:
+            page = document[page_num]
+            page_info = (page_num, page, page.rect.width, page.rect.height)
+            results.extend(process_page(page_info, None, qr_detector, image_results))
+        except Exception as e:
+            errors.append((page_num, str(e)))
+    
+    return page_nums, results, errors, render_tracker.peak, stage_tracker.stages
+
+def split_page_groups(page_nums):
+    """Split pages into ordered tasks of PAGE_TASK_SIZE pages for the scheduler"""
+    group_size = max(1, PAGE_TASK_SIZE)
+    return [page_nums[start:start + group_size] for start in range(0, len(page_nums), group_size)]
+
+def group_results_by_page(results):
+    """Group QR results by 0-based page number"""
+    results_by_page = {}
+    for qr in results:
+        results_by_page.setdefault(qr['page'] - 1, []).append(qr)
+    return results_by_page
+
+def extract_with_process_pool(pdf_source, page_nums, job_id=None, on_page=None, page_bytes=None, backend=None,
+                              stage_stats=None):
+    """Render and detect pages in the warm worker processes, outside the GIL.
+
+    Returns (results, failed_pages). on_page is called for each page of a
+    group as soon as the group comes back. page_bytes maps pages to their
+    estimated pixmap size, reserved in the pixmap budget while they render.
+    backend names the detector backend the workers use (QR_BACKEND by default).
+    The workers' detection stage timings are added to stage_stats, if given.
+    """
+    results = []
+    failed_pages = []
+    
+    pool = start_page_worker_pool()
+    page_groups = split_page_groups(page_nums)
+    
+    with resource_lock:
+        system_stats['active_workers'] = min(pool.size, len(page_groups))
+    
+    logger.info(f"Processing {len(page_nums)} pages in {len(page_groups)} groups on {pool.size} warm workers")
+    
+    with shared_pdf_source(pdf_source) as pdf_ref:
+        future_to_group = {
+            pool.submit(process_page_group, pdf_ref, group, backend, job_id=job_id, pages=len(page_nums),
+                        reserve_bytes=max((page_bytes or {}).get(page_num, 0) for page_num in group),
+                        document=pdf_ref): group
+            for group in page_groups
+        }
+        
+        try:
+            collect_page_groups(future_to_group, job_id, on_page, results, failed_pages, stage_stats)
+        finally:
+            # Every worker that opened the document closes it once the job is done
+            pool.release_document(pdf_ref)
+    
+    return results, failed_pages
+
+def collect_page_groups(future_to_group, job_id, on_page, results, failed_pages, stage_stats):
+    """Gather a job's page groups from the worker pool into results and failed_pages as they finish"""
+    for future in concurrent.futures.as_completed(future_to_group):
+        if is_job_cancelled(job_id):
+            # Stop waiting so the shared memory is unlinked now; tasks still
+            # queued are dropped and workers that already copied the PDF
+            # don't need it any more
+            break
+        
+        group = future_to_group[future]
+        try:
+            _, group_results, group_errors, used_bytes, stages = future.result()
+            pixmap_budget.record_used(used_bytes)
+            merge_stage_timings(stages, stage_stats)
+            results.extend(group_results)
+            for page_num, error in group_errors:
+                logger.error(f"Error processing page {page_num + 1} for job {job_id}: {error}")
+                failed_pages.append(page_num)
+            
+            if on_page:
+                group_errors = dict(group_errors)
+                results_by_page = group_results_by_page(group_results)
+                for page_num in group:
+                    if page_num in group_errors:
+                        on_page(page_num, None, group_errors[page_num])
+                    else:
+                        on_page(page_num, results_by_page.get(page_num, []))
+        except Exception as e:
+            logger.error(f"Error processing pages {group[0] + 1}-{group[-1] + 1}: {e}")
+            failed_pages.extend(group)
+            if on_page:
+                for page_num in group:
+                    on_page(page_num, None, str(e))
+        
+        with resource_lock:
+            system_stats['processed_pages'] += len(group)
+
+def check_cancelled(cancel_event, job_id):
+    """Raise if the job's cancellation token has been set"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise Exception(f"Job {job_id} was cancelled")
+
+def extract_qr_positions_from_pdf(pdf_path, job_id=None, cache_key=None, on_page=None, backend=None):
+    """Extract positions of QR codes from a PDF file.
+
+    pdf_path may also be the PDF content as bytes or a memoryview. Results are served from and
+    stored in the result cache under cache_key (computed when not given).
+    on_page(page_num, num_pages, page_results, error) is called from worker
+    threads as each page finishes, with error set for pages that failed.
+    backend selects the detector backend (QR_BACKEND by default).
+    """
+    # Callers passing a key have already looked it up
+    if cache_key is None:
+        cache_key = result_cache_key(pdf_path, backend)
+        
+        cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info(f"Result cache hit for job {job_id} ({len(cached_result)} QR codes)")
+            return cached_result
+    
+    results = []
+    failed_pages = []  # Results with failed pages are incomplete and never cached
+    
+    # Page renders stay in memory; a temp directory is only used for debugging
+    temp_dir = None
+    if SAVE_DEBUG_IMAGES:
+        temp_dir = os.path.join(os.getcwd(), "temp", f"qr_extract_{job_id or uuid.uuid4()}")
+        try:
+            os.makedirs(temp_dir, exist_ok=True)
+            logger.info(f"Created temporary directory: {temp_dir}")
+        except Exception as e:
+            raise Exception(f"Failed to create temporary directory: {e}")
+    
+    pdf_document = None
+    try:
+        # Verify file exists
+        if isinstance(pdf_path, str) and not os.path.exists(pdf_path):
+            raise Exception(f"PDF file not found at: {pdf_path}")
+        
+        # Open the PDF file with memory optimization
+        try:
+            if isinstance(pdf_path, str):
+                pdf_document = fitz.open(pdf_path)
+            else:
+                pdf_document = fitz.open(stream=pdf_path, filetype="pdf")
+            num_pages = len(pdf_document)
+            logger.info(f"Opened PDF with {num_pages} pages")
+            
+            report_page = None
+            if on_page:
+                report_page = lambda page_num, page_results, error=None: on_page(page_num, num_pages, page_results, error)
             
             # Update global stats
             with resource_lock:
@@ -571,18 +2703,68 @@ def extract_qr_positions_from_pdf(pdf_path, job_id=None):
         except Exception as e:
             raise Exception(f"Failed to open PDF document: {e}")
         
+        # Pages seen before (in this or any other document) skip rendering
+        page_keys = {}
+        pending_pages = []
+        stream_digests = {}
+        for page_num in range(num_pages):
+            try:
+                page_keys[page_num] = page_cache_key(pdf_document, pdf_document[page_num], stream_digests, backend)
+            except Exception as e:
+                logger.warning(f"Could not hash page {page_num + 1}: {e}")
+                pending_pages.append(page_num)
+                continue
+            
+            cached_page = page_cache.get(page_keys[page_num])
+            if cached_page is None:
+                pending_pages.append(page_num)
+            else:
+                page_results = [{'page': page_num + 1, **qr} for qr in cached_page]
+                results.extend(page_results)
+                if report_page:
+                    report_page(page_num, page_results)
+        
+        cached_pages = num_pages - len(pending_pages)
+        if cached_pages:
+            logger.info(f"Reusing cached results for {cached_pages} of {num_pages} pages")
+            with resource_lock:
+                system_stats['processed_pages'] += cached_pages
+        
+        cancel_event = job_cancel_event(job_id) if job_id else None
+        check_cancelled(cancel_event, job_id)
+        
+        if job_id:
+            with resource_lock:
+                job_metrics[job_id] = {
+                    'pages': num_pages,
+                    'page_cache_hits': cached_pages,
+                    'page_cache_hit_rate': cached_pages / num_pages if num_pages else 0
+                }
+        
+        computed_results = []
+        image_results = {}  # Embedded images decoded by the thread engine, shared by its pages
+        stage_stats = StageStats()  # This job's detection stage timings
+        
+        # Worker processes open their own copy of the document, so PyMuPDF
+        # objects are never shared between threads
+        if pending_pages and EXECUTION_ENGINE == 'process' and temp_dir is None:
+            page_bytes = {page_num: estimate_page_render_bytes(pdf_document[page_num]) for page_num in pending_pages}
+            computed_results, failed_pages = extract_with_process_pool(pdf_path, pending_pages, job_id, report_page,
+                                                                       page_bytes, backend, stage_stats)
+        
         # For large PDFs, process in smaller batches to manage memory
-        if num_pages > PAGE_BATCH_SIZE:
-            logger.info(f"Large PDF detected ({num_pages} pages). Processing in batches of {PAGE_BATCH_SIZE}")
+        elif len(pending_pages) > PAGE_BATCH_SIZE:
+            logger.info(f"Large PDF detected ({len(pending_pages)} pages). Processing in batches of {PAGE_BATCH_SIZE}")
             
             # Process the PDF in batches
-            for batch_start in range(0, num_pages, PAGE_BATCH_SIZE):
-                batch_end = min(batch_start + PAGE_BATCH_SIZE, num_pages)
-                logger.info(f"Processing batch from page {batch_start + 1} to {batch_end}")
+            for batch_start in range(0, len(pending_pages), PAGE_BATCH_SIZE):
+                check_cancelled(cancel_event, job_id)
+                batch_pages = pending_pages[batch_start:batch_start + PAGE_BATCH_SIZE]
+                logger.info(f"Processing batch from page {batch_pages[0] + 1} to {batch_pages[-1] + 1}")
                 
                 # Create page info for this batch
                 batch_page_infos = []
-                for page_num in range(batch_start, batch_end):
+                for page_num in batch_pages:
                     page = pdf_document[page_num]
                     batch_page_infos.append((page_num, page, page.rect.width, page.rect.height))
                 
@@ -609,38 +2791,43 @@ def extract_qr_positions_from_pdf(pdf_path, job_id=None):
                     # Submit chunks for processing
                     futures = []
                     for chunk in chunks:
-                        process_func = partial(process_page_batch, temp_dir=temp_dir, job_id=job_id)
+                        process_func = partial(process_page_batch, temp_dir=temp_dir, job_id=job_id,
+                                               failed_pages=failed_pages, image_results=image_results,
+                                               on_page=report_page, cancel_event=cancel_event, backend=backend,
+                                               stage_stats=stage_stats)
                         futures.append(executor.submit(process_func, chunk))
                     
                     # Collect results from all chunks
                     for future in concurrent.futures.as_completed(futures):
                         try:
                             batch_results = future.result()
-                            results.extend(batch_results)
+                            computed_results.extend(batch_results)
                         except Exception as e:
                             logger.error(f"Error processing batch: {e}")
+                            failed_pages.extend(page_info[0] for page_info in batch_page_infos)
                 
                 # Force cleanup between batches
                 gc.collect()
                 
                 # Yield to other processes/threads
                 time.sleep(0.1)
-        else:
+        elif pending_pages:
             # For smaller PDFs, process normally
-            page_infos = [(page_num, page, page.rect.width, page.rect.height) 
-                         for page_num, page in enumerate(pdf_document)]
+            page_infos = [(page_num, pdf_document[page_num], pdf_document[page_num].rect.width,
+                           pdf_document[page_num].rect.height) for page_num in pending_pages]
             
             # Use a reasonable worker count
-            max_workers = min(WORKER_POOL_SIZE, num_pages)
+            max_workers = min(WORKER_POOL_SIZE, len(pending_pages))
             
             with resource_lock:
                 system_stats['active_workers'] = max_workers
             
-            logger.info(f"Processing {num_pages} pages with {max_workers} workers")
+            logger.info(f"Processing {len(pending_pages)} pages with {max_workers} workers")
             
             with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
                 # Create a partial function with the temp_dir
-                process_func = partial(process_page, temp_dir=temp_dir, qr_detector=None)
+                process_func = partial(process_page_budgeted, temp_dir=temp_dir, qr_detector=None,
+                                       image_results=image_results, backend=backend, stage_stats=stage_stats)
                 
                 # Submit all tasks and collect futures
                 future_to_page = {executor.submit(process_func, page_info): page_info[0] 
@@ -648,23 +2835,55 @@ def extract_qr_positions_from_pdf(pdf_path, job_id=None):
                 
                 # Process results as they complete
                 for future in concurrent.futures.as_completed(future_to_page):
+                    if cancel_event is not None and cancel_event.is_set():
+                        # Pages already rendering finish; the rest never start
+                        for pending_future in future_to_page:
+                            pending_future.cancel()
+                        break
+                    
                     page_num = future_to_page[future]
                     try:
                         page_results = future.result()
-                        results.extend(page_results)
+                        computed_results.extend(page_results)
                         
                         # Update progress
                         with resource_lock:
                             system_stats['processed_pages'] += 1
+                        
+                        if report_page:
+                            report_page(page_num, page_results)
                             
                     except Exception as e:
                         logger.error(f"Error processing page {page_num + 1}: {e}")
+                        failed_pages.append(page_num)
+                        if report_page:
+                            report_page(page_num, None, str(e))
                         # Still count as processed for progress tracking
                         with resource_lock:
                             system_stats['processed_pages'] += 1
         
-        # Close the PDF document
-        pdf_document.close()
+        check_cancelled(cancel_event, job_id)
+        
+        # Memoize every page that was processed successfully, including empty ones
+        results_by_page = group_results_by_page(computed_results)
+        for page_num in set(pending_pages) - set(failed_pages):
+            if page_num in page_keys:
+                page_cache.put(page_keys[page_num], results_by_page.get(page_num, []))
+        results.extend(computed_results)
+        
+        if num_pages:
+            logger.info(f"Page cache hit rate for job {job_id}: {cached_pages / num_pages:.0%}")
+        
+        stages = stage_stats.stats()
+        if 'prefilter' in stages:
+            logger.info(f"Finder prefilter rejected {stages['prefilter']['rejected']} of "
+                        f"{stages['prefilter']['calls']} images for job {job_id}")
+        if job_id:
+            with resource_lock:
+                job_metrics[job_id]['stages'] = stages
+        
+        if not failed_pages:
+            result_cache.put(cache_key, results)
         
         # Reset worker count
         with resource_lock:
@@ -676,16 +2895,21 @@ def extract_qr_positions_from_pdf(pdf_path, job_id=None):
         logger.error(f"Error extracting QR codes: {e}")
         raise
     finally:
+        # Close the PDF document, also when the job was cancelled or failed
+        if pdf_document is not None:
+            pdf_document.close()
+        
         # Reset stats
         with resource_lock:
             system_stats['active_workers'] = 0
         
         # Clean up the temp directory
-        try:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            logger.info(f"Cleaned up temporary directory: {temp_dir}")
-        except Exception as e:
-            logger.warning(f"Could not remove temp directory {temp_dir}: {e}")
+        if temp_dir:
+            try:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                logger.info(f"Cleaned up temporary directory: {temp_dir}")
+            except Exception as e:
+                logger.warning(f"Could not remove temp directory {temp_dir}: {e}")
         
         # Force garbage collection
         gc.collect()
@@ -709,10 +2933,21 @@ def clean_expired_results():
                 for job_id in expired_jobs:
                     if job_id in job_results:
                         del job_results[job_id]
+                    job_metrics.pop(job_id, None)
+                    job_cancel_events.pop(job_id, None)
+                
+                # Scheduling classes and tokens outlive their jobs by at most an hour
+                for job_id in [job_id for job_id, schedule in job_schedules.items() if current_time - schedule[2] > 3600]:
+                    del job_schedules[job_id]
+                    job_cancel_events.pop(job_id, None)
             
             if expired_jobs:
                 logger.info(f"Cleaned up {len(expired_jobs)} expired job results")
             
+            expired_entries = result_cache.expire()
+            if expired_entries:
+                logger.info(f"Expired {expired_entries} cached results")
+            
             # Force garbage collection
             gc.collect()
             
@@ -751,8 +2986,12 @@ def main():
     
     logger.info(f"Starting QR code extraction service with {WORKER_POOL_SIZE} worker threads")
     
+    # Warm up page workers before accepting requests
+    if EXECUTION_ENGINE == 'process':
+        start_page_worker_pool()
+    
     # Ensure directories exist
-    for dir_name in ['temp', 'uploads']:
+    for dir_name in ['temp']:
         dir_path = os.path.join(os.getcwd(), dir_name)
         os.makedirs(dir_path, exist_ok=True)
         logger.info(f"Ensured directory exists: {dir_path}")
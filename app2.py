@@ -1,16 +1,41 @@
 import os
+import io
+import json
 import time
 import uuid
 import shutil
 import psutil
+import tarfile
+import zipfile
 import threading
+import concurrent.futures
 import cv2
 import numpy as np
-from flask import Flask, request, jsonify
+import qr_backends
+import qr_shapes
+from flask import Flask, request, jsonify, Response, stream_with_context
 from pathlib import Path
 
+QR_BACKEND = 'opencv'  # Default detector backend: 'opencv', 'wechat' or 'pyzbar'
+BATCH_WORKERS = min(os.cpu_count() or 4, 8)  # Threads detecting the images of batch requests
+BATCH_IN_FLIGHT = 2 * BATCH_WORKERS  # Images of one batch request held in memory at once
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp')  # Archive members treated as images
+CONTOUR_MIN_SIZE = 30  # Smallest shape reported by the contour fallback, in image pixels
+ARCHIVE_TYPES = {  # Request content types accepted as a raw archive body
+    'application/zip': '.zip',
+    'application/x-tar': '.tar',
+    'application/gzip': '.tar.gz',
+    'application/x-gzip': '.tar.gz'
+}
+
 app = Flask(__name__)
 
+# Shared by all batch requests, so each thread's detector is set up once
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS)
+
+# Detector backends that can be created here, found on first use
+available_qr_backends = None
+
 # Global variables to store resource usage
 system_stats = {
     'cpu_percent': 0,
@@ -55,6 +80,11 @@ def extract_qr():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
+    backend = request.form.get('backend') or QR_BACKEND
+    if backend not in get_available_backends():
+        return jsonify({'error': f"Unknown or unavailable backend '{backend}'",
+                        'available_backends': get_available_backends()}), 400
+    
     try:
         # Create a unique upload directory for this specific request
         request_id = str(uuid.uuid4())
@@ -77,12 +107,9 @@ def extract_qr():
             
         print(f"Successfully saved uploaded file: {image_path} (size: {os.path.getsize(image_path)} bytes)")
         
-        # Force a small delay to ensure file is fully written to disk
-        time.sleep(0.1)
-        
         # Process the image to extract QR codes
         start_time = time.time()
-        qr_positions = process_image(image_path)
+        qr_positions = process_image(image_path, backend)
         elapsed_time = time.time() - start_time
         print(f"Found {len(qr_positions)} QR codes in the image in {elapsed_time:.2f} seconds")
 
@@ -108,12 +135,49 @@ def extract_qr():
         except Exception as cleanup_error:
             print(f"Warning: Could not remove temporary files: {cleanup_error}")
 
-def process_image(image_path):
+@app.route('/extract_qr_batch', methods=['POST'])
+def extract_qr_batch():
+    """
+    Extract QR codes from many images in one request.
+    
+    Accepts a multipart list of images (field 'files' or 'file'; zip and tar
+    archives among them are expanded), or a raw zip/tar body. Images are
+    decoded in memory and results are streamed back as NDJSON, one line per
+    image.
+    """
+    backend = request.form.get('backend') or request.args.get('backend') or QR_BACKEND
+    if backend not in get_available_backends():
+        return jsonify({'error': f"Unknown or unavailable backend '{backend}'",
+                        'available_backends': get_available_backends()}), 400
+    
+    # Uploads are read only when their images are submitted. Flask closes the
+    # request's files as soon as the view returns, before the response
+    # streams, so their spooled streams are detached from the request here
+    # and closed by iter_batch_images instead
+    uploads = []
+    for upload in request.files.getlist('files') + request.files.getlist('file'):
+        uploads.append((upload.filename or '', upload.stream))
+        upload.stream = io.BytesIO()
+    
+    if not uploads and request.mimetype in ARCHIVE_TYPES:
+        archive_type = ARCHIVE_TYPES[request.mimetype]
+        # Zip archives need a seekable file; tar archives are read as they arrive
+        stream = io.BytesIO(request.get_data()) if archive_type == '.zip' else request.stream
+        uploads = [(f"upload{archive_type}", stream)]
+    
+    if not uploads:
+        return jsonify({'error': 'No files in request'}), 400
+    
+    return Response(stream_with_context(stream_batch_results(iter_batch_images(uploads), backend)),
+                    mimetype='application/x-ndjson')
+
+def process_image(image_path, backend=QR_BACKEND):
     """
     Process an image to extract QR codes.
     
     Args:
         image_path (str): Path to the image file
+        backend (str): Detector backend name (see qr_backends.py)
         
     Returns:
         list: List of QR code information dictionaries
@@ -150,53 +214,7 @@ def process_image(image_path):
             print(error_msg)
             raise Exception(error_msg)
         
-        # Get image dimensions
-        img_height, img_width = img.shape[:2]
-        
-        # Initialize QR code detector
-        qr_detector = cv2.QRCodeDetector()
-        
-        # Detect QR codes
-        retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(img)
-        
-        if retval:
-            # Process each QR code found
-            for i, qr_points in enumerate(points):
-                # Convert to a four-point array if needed
-                qr_points = qr_points.astype(int)
-                
-                # Get x and y values from points
-                x_values = [p[0] for p in qr_points]
-                y_values = [p[1] for p in qr_points]
-                
-                min_x, max_x = min(x_values), max(x_values)
-                min_y, max_y = min(y_values), max(y_values)
-                
-                # Store QR code information
-                qr_info = {
-                    'polygon': qr_points.tolist(),  # Convert numpy array to list
-                    'bbox': {
-                        'x1': int(min_x),
-                        'y1': int(min_y),
-                        'x2': int(max_x),
-                        'y2': int(max_y),
-                        'width': int(max_x - min_x),
-                        'height': int(max_y - min_y)
-                    },
-                    'center': {
-                        'x': int((min_x + max_x) / 2),
-                        'y': int((min_y + max_y) / 2)
-                    },
-                    'data': decoded_info[i] if i < len(decoded_info) else "Unable to decode"
-                }
-                
-                results.append(qr_info)
-        
-        # If no QR codes found, try alternative method
-        if not results:
-            print("Using alternative detection method...")
-            alt_results = process_image_contours(img)
-            results.extend(alt_results)
+        results = detect_qr_codes(img, backend)
         
         # Update processed count
         system_stats['processed_images'] = 1
@@ -208,60 +226,204 @@ def process_image(image_path):
     
     return results
 
-def process_image_contours(img):
+def get_available_backends():
+    """Detector backends that can be created in this environment"""
+    global available_qr_backends
+    if available_qr_backends is None:
+        available_qr_backends = qr_backends.available_backends()
+    return available_qr_backends
+
+def detect_qr_codes(img, backend=QR_BACKEND):
     """
-    Process an image with contour-based detection for QR codes.
+    Detect QR codes in a loaded image, falling back to contour detection.
     
     Args:
         img: OpenCV image
+        backend (str): Detector backend name (see qr_backends.py)
         
     Returns:
-        list: List of potential QR code information dictionaries
+        list: List of QR code information dictionaries
     """
     results = []
     
-    try:
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Detect QR codes with this thread's instance of the backend
+    detections = qr_backends.thread_backend(backend).detect(img)
+    
+    # Process each QR code found
+    for qr_points, data in detections:
+        # Convert to a four-point array if needed
+        qr_points = qr_points.astype(int)
         
-        # Apply threshold
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
+        # Get x and y values from points
+        x_values = [p[0] for p in qr_points]
+        y_values = [p[1] for p in qr_points]
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        min_x, max_x = min(x_values), max(x_values)
+        min_y, max_y = min(y_values), max(y_values)
         
-        # Image dimensions
-        img_height, img_width = img.shape[:2]
+        # Store QR code information
+        qr_info = {
+            'polygon': qr_points.tolist(),  # Convert numpy array to list
+            'bbox': {
+                'x1': int(min_x),
+                'y1': int(min_y),
+                'x2': int(max_x),
+                'y2': int(max_y),
+                'width': int(max_x - min_x),
+                'height': int(max_y - min_y)
+            },
+            'center': {
+                'x': int((min_x + max_x) / 2),
+                'y': int((min_y + max_y) / 2)
+            },
+            'data': data
+        }
         
-        # Look for square-like contours (potential QR codes)
-        for contour in contours:
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour)
-            
-            # QR codes are typically square-ish, calculate aspect ratio
-            aspect_ratio = float(w) / h
+        results.append(qr_info)
+    
+    # If no QR codes found, try alternative method
+    if not results:
+        print("Using alternative detection method...")
+        results.extend(process_image_contours(img))
+    
+    return results
+
+def decode_image(data):
+    """
+    Decode an encoded image held in memory.
+    
+    Args:
+        data (bytes): Encoded image (PNG, JPEG, ...)
+        
+    Returns:
+        OpenCV BGR image
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    
+    if img is None:
+        # Formats OpenCV can't read go through PIL
+        try:
+            from PIL import Image
+            pil_img = Image.open(io.BytesIO(data)).convert('RGB')
+            img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
+        except Exception as pil_err:
+            raise Exception(f"Failed to decode image: {pil_err}")
+    
+    if img.size == 0:
+        raise Exception("Image has zero size")
+    
+    return img
+
+def process_batch_image(data, backend=QR_BACKEND):
+    """Decode one image of a batch in memory and detect its QR codes (runs on the batch pool)"""
+    return detect_qr_codes(decode_image(data), backend)
+
+def iter_batch_images(uploads):
+    """
+    Yield (filename, bytes) for every image of a batch request, one at a time.
+    
+    Zip and tar (optionally gzipped) uploads are expanded, reading one
+    member at a time, so a raw tar body is consumed as it arrives. Uploads
+    are read only when their images are reached, and each is closed once
+    it has been read.
+    
+    Args:
+        uploads (list): (filename, file object) pairs
+    """
+    for filename, stream in uploads:
+        lower_name = filename.lower()
+        
+        try:
+            if lower_name.endswith('.zip'):
+                with zipfile.ZipFile(stream) as archive:
+                    for info in archive.infolist():
+                        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                            yield info.filename, archive.read(info)
+            elif lower_name.endswith(('.tar', '.tar.gz', '.tgz')):
+                # Streaming mode, so the archive never has to be seekable
+                with tarfile.open(fileobj=stream, mode='r|*') as archive:
+                    for member in archive:
+                        if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                            yield member.name, archive.extractfile(member).read()
+            else:
+                yield filename, stream.read()
+        finally:
+            stream.close()
+
+def stream_batch_results(images, backend=QR_BACKEND):
+    """
+    Detect QR codes in a stream of (filename, bytes) images on the batch pool.
+    
+    Yields one NDJSON line per image as soon as it is done (in completion
+    order, with its index in the batch), then a summary line. At most
+    BATCH_IN_FLIGHT images are held at once.
+    """
+    start_time = time.time()
+    pending = {}  # future -> (index, filename)
+    counts = {'images': 0, 'qr_codes': 0, 'errors': 0}
+    
+    def finish(future):
+        index, filename = pending.pop(future)
+        try:
+            results = future.result()
+            counts['qr_codes'] += len(results)
+            line = {'event': 'image', 'index': index, 'filename': filename, 'results': results}
+        except Exception as e:
+            counts['errors'] += 1
+            line = {'event': 'image', 'index': index, 'filename': filename, 'error': str(e)}
+        system_stats['processed_images'] += 1
+        return json.dumps(line) + "\n"
+    
+    try:
+        for index, (filename, data) in enumerate(images):
+            while len(pending) >= BATCH_IN_FLIGHT:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield finish(future)
             
-            # Check if it's somewhat square and not too small
-            if 0.7 <= aspect_ratio <= 1.3 and w >= 30 and h >= 30:
-                qr_info = {
-                    'bbox': {
-                        'x1': int(x),
-                        'y1': int(y),
-                        'x2': int(x + w),
-                        'y2': int(y + h),
-                        'width': int(w),
-                        'height': int(h)
-                    },
-                    'center': {
-                        'x': int(x + w/2),
-                        'y': int(y + h/2)
-                    },
-                    'detection_method': 'contour',
-                    'confidence': 'low',  # This is just a potential QR code
-                    'data': 'Unknown (detected by shape only)'
-                }
-                
-                results.append(qr_info)
+            counts['images'] += 1
+            system_stats['total_images'] += 1
+            pending[batch_executor.submit(process_batch_image, data, backend)] = (index, filename)
+        
+        for future in concurrent.futures.as_completed(list(pending)):
+            yield finish(future)
+    except Exception as e:
+        # A broken archive ends the batch; images already read are still reported
+        print(f"Error reading batch: {e}")
+        for future in concurrent.futures.as_completed(list(pending)):
+            yield finish(future)
+        yield json.dumps({'event': 'error', 'error': f'Error reading batch: {e}'}) + "\n"
+    
+    elapsed_time = time.time() - start_time
+    print(f"Found {counts['qr_codes']} QR codes in {counts['images']} images in {elapsed_time:.2f} seconds")
+    yield json.dumps({'event': 'summary', **counts, 'seconds': round(elapsed_time, 3)}) + "\n"
+
+def process_image_contours(img):
+    """
+    Process an image with contour-based detection for QR codes.
+    
+    Shapes are found by qr_shapes.find_contour_candidates, which only keeps
+    those with finder patterns and a locatable QR code. Boxes stay in image
+    pixels.
+    
+    Args:
+        img: OpenCV image
+        
+    Returns:
+        list: List of potential QR code information dictionaries
+    """
+    results = []
+    
+    try:
+        img_height, img_width = img.shape[:2]
+        for qr_info in qr_shapes.find_contour_candidates(img, 0, img_width, img_height, min_size=CONTOUR_MIN_SIZE):
+            del qr_info['page']
+            qr_info['center'] = {
+                'x': int(qr_info['center']['x']),
+                'y': int(qr_info['center']['y'])
+            }
+            qr_info['data'] = 'Unknown (detected by shape only)'
+            results.append(qr_info)
     
     except Exception as e:
         print(f"Error in contour processing: {e}")
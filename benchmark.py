@@ -0,0 +1,128 @@
+import os
+import time
+import argparse
+import logging
+from collections import Counter
+
+import fitz  # PyMuPDF
+import app as qr_app
+
+# Settings of app.py compared by the benchmark. Recall is measured against
+# the first configuration that is run. The *-render configurations turn off
+# the vector prepass and direct image decoding so every page is rendered;
+# wechat and pyzbar swap the detector backend (skipped when unavailable);
+# no-prefilter runs the detector on every image the finder prefilter would skip
+# and untiled detects large renders whole instead of in tiles.
+RENDER_ONLY = {'VECTOR_PREPASS': False, 'DIRECT_IMAGE_DECODE': False}
+CONFIGS = {
+    'rgb': {'RENDER_MODE': 'rgb', 'DETECT_MAX_PIXELS': None},
+    'gray': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None},
+    'gray-4mp': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': 4000000},
+    'rgb-render': {'RENDER_MODE': 'rgb', 'DETECT_MAX_PIXELS': None, **RENDER_ONLY},
+    'gray-render': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None, **RENDER_ONLY},
+    'gray-4mp-render': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': 4000000, **RENDER_ONLY},
+    'untiled-render': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None, 'TILED_DETECTION': False, **RENDER_ONLY},
+    'gray-no-prefilter': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None, 'FINDER_PREFILTER': False},
+    'wechat': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None, 'QR_BACKEND': 'wechat'},
+    'pyzbar': {'RENDER_MODE': 'gray', 'DETECT_MAX_PIXELS': None, 'QR_BACKEND': 'pyzbar'},
+}
+
+DEFAULT_PDFS = ['omegamotor_catalog_en2.pdf', 'output.pdf', 'A-90L-B35-T.pdf']
+
+def apply_settings(settings):
+    """Set module-level settings of app.py and return their previous values"""
+    previous = {name: getattr(qr_app, name) for name in settings}
+    for name, value in settings.items():
+        setattr(qr_app, name, value)
+    return previous
+
+def reset_state():
+    """Start every run cold: no cached results and fresh pixmap and stage metrics"""
+    qr_app.result_cache = qr_app.ResultCache(0, 0)
+    qr_app.page_cache = qr_app.PageCache(0)
+    qr_app.pixmap_budget = qr_app.PixmapBudget(qr_app.PIXMAP_BUDGET_BYTES)
+    qr_app.detection_stages = qr_app.StageStats()
+
+def run_config(settings, pdf_paths, repeat):
+    """Extract QR codes from every PDF `repeat` times with the given settings"""
+    previous = apply_settings(settings)
+    found = Counter()
+    elapsed = 0.0
+    pages = 0
+    peak_pixmap = 0
+    prefiltered = 0
+    rejected = 0
+
+    try:
+        for pdf_path in pdf_paths:
+            with fitz.open(pdf_path) as pdf_document:
+                page_count = len(pdf_document)
+
+            for _ in range(repeat):
+                reset_state()
+                start = time.perf_counter()
+                results = qr_app.extract_qr_positions_from_pdf(pdf_path)
+                elapsed += time.perf_counter() - start
+                pages += page_count
+                peak_pixmap = max(peak_pixmap, qr_app.pixmap_budget.stats()['peak_used_bytes'])
+                prefilter = qr_app.detection_stages.stats().get('prefilter', {})
+                prefiltered += prefilter.get('calls', 0)
+                rejected += prefilter.get('rejected', 0)
+
+            found.update((os.path.basename(pdf_path), qr['page'], qr['data']) for qr in results)
+    finally:
+        apply_settings(previous)
+
+    return {
+        'seconds': elapsed,
+        'pages_per_second': pages / elapsed if elapsed else 0,
+        'qr_codes': sum(found.values()),
+        'found': found,
+        'peak_pixmap_bytes': peak_pixmap,
+        'prefilter_rejection_rate': rejected / prefiltered if prefiltered else 0
+    }
+
+def recall(found, reference):
+    """Share of the reference detections (same PDF, page and data) that were found"""
+    expected = sum(reference.values())
+    if not expected:
+        return 1.0
+    return sum(min(count, found[key]) for key, count in reference.items()) / expected
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QR extraction throughput and recall")
+    parser.add_argument('pdfs', nargs='*', default=DEFAULT_PDFS, help="PDFs to run (default: the samples)")
+    parser.add_argument('--configs', default=','.join(CONFIGS), help="Comma-separated configurations to compare")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per PDF and configuration")
+    parser.add_argument('--workers', type=int, default=max(1, min((os.cpu_count() or 4) - 1, 4)),
+                        help="Page worker threads")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Worker processes import app.py afresh and would not see the settings
+    # being compared, so the benchmark runs pages on the thread engine
+    qr_app.EXECUTION_ENGINE = 'thread'
+    qr_app.WORKER_POOL_SIZE = args.workers
+
+    names = [name.strip() for name in args.configs.split(',') if name.strip()]
+    available = qr_app.get_available_backends()
+    reference = None
+
+    print(f"{'config':<16}{'seconds':>10}{'pages/s':>10}{'QR codes':>10}{'recall':>8}{'peak pixmap MB':>16}{'prefiltered':>13}")
+    for name in names:
+        backend = CONFIGS[name].get('QR_BACKEND', qr_app.QR_BACKEND)
+        if backend not in available:
+            print(f"{name:<16}skipped: backend '{backend}' is not available")
+            continue
+
+        stats = run_config(CONFIGS[name], args.pdfs, args.repeat)
+        if reference is None:
+            reference = stats['found']
+
+        print(f"{name:<16}{stats['seconds']:>10.2f}{stats['pages_per_second']:>10.2f}{stats['qr_codes']:>10}"
+              f"{recall(stats['found'], reference):>8.0%}{stats['peak_pixmap_bytes'] / 1e6:>16.1f}"
+              f"{stats['prefilter_rejection_rate']:>13.0%}")
+
+if __name__ == "__main__":
+    main()
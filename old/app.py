@@ -1,14 +1,52 @@
 import fitz  # PyMuPDF
 import os
 import re
-from PIL import Image
-import io
+import csv
+import json
+import time
+import argparse
+import concurrent.futures
+from bisect import bisect_left, bisect_right
+
+# List of patterns to remove (based on your images)
+SENSITIVE_PATTERNS = [
+    r'www\.omegamotor\.com\.tr',
+    r'info@omegamotor\.com\.tr',
+    r'\+90\s*216\s*266\s*32\s*80',
+    r'\+90\s*216\s*266\s*32\s*89',
+    r'Dudullu Organize Sanayi Bölgesi.*Istanbul',
+    # Add more patterns as needed
+]
+
+MANIFEST_NAME = '.manifest.jsonl'  # Completed outputs, in the output folder; reruns skip them
+REPORT_NAME = 'timing_report.csv'  # Per-file timings of the last run, in the output folder
+
+# The PDFProcessor of a batch worker process, created by init_worker()
+worker_processor = None
+
+def init_worker(input_folder, output_folder, cover_image_path, patterns, cover_pdf):
+    global worker_processor
+    worker_processor = PDFProcessor(input_folder, output_folder, cover_image_path, patterns, cover_pdf)
+
+def process_file(input_path, output_path):
+    """Process one PDF in a batch worker and return (pages, seconds)"""
+    start_time = time.time()
+    pages = worker_processor.process_pdf(input_path, output_path)
+    return pages, time.time() - start_time
 
 class PDFProcessor:
-    def __init__(self, input_folder, output_folder, cover_image_path):
+    def __init__(self, input_folder, output_folder, cover_image_path, patterns=SENSITIVE_PATTERNS, cover_pdf=None):
         self.input_folder = input_folder
         self.output_folder = output_folder
         self.cover_image_path = cover_image_path
+        self.patterns = patterns
+        
+        # One-page PDF holding the cover image, built on first use (or passed in by a batch)
+        self.cover_pdf = cover_pdf
+        self.cover_document = None
+        
+        # All patterns in one regex, so each page's text is scanned once
+        self.sensitive_regex = re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), re.IGNORECASE)
         
         # Create output folder if it doesn't exist
         if not os.path.exists(output_folder):
@@ -21,26 +59,59 @@ class PDFProcessor:
             return match.group(1)
         return filename.split('.')[0]
 
-    def remove_sensitive_info(self, page):
-        # List of patterns to remove (based on your images)
-        patterns = [
-            r'www\.omegamotor\.com\.tr',
-            r'info@omegamotor\.com\.tr',
-            r'\+90\s*216\s*266\s*32\s*80',
-            r'\+90\s*216\s*266\s*32\s*89',
-            r'Dudullu Organize Sanayi Bölgesi.*Istanbul',
-            # Add more patterns as needed
-        ]
-        
-        for pattern in patterns:
-            # First try with regular search
-            areas = page.search_for(pattern, flags=re.IGNORECASE)
+    def build_word_index(self, page):
+        """Extract the page's words once and index them by their position in the page text.
+
+        Returns (text, starts, words): words of a line are joined by spaces
+        and lines by newlines, starts[i] is the offset of words[i] in text.
+        """
+        words = page.get_text("words")
+        pieces = []
+        starts = []
+        offset = 0
+        previous_line = None
+        
+        for word in words:
+            line = word[5:7]  # (block, line)
+            if previous_line is not None:
+                pieces.append(' ' if line == previous_line else '\n')
+                offset += 1
+            starts.append(offset)
+            pieces.append(word[4])
+            offset += len(word[4])
+            previous_line = line
+        
+        return ''.join(pieces), starts, words
+
+    def match_rects(self, start, end, starts, words):
+        """Rectangles covering text[start:end], one per line of the matched words"""
+        first = bisect_right(starts, start) - 1
+        last = bisect_left(starts, end) - 1
+        
+        rects = {}
+        for i in range(max(first, 0), last + 1):
+            x0, y0, x1, y1, text = words[i][:5]
             
-            # Then try with text extraction to catch more instances
-            text_instances = page.get_text("text")
-            matches = re.finditer(pattern, text_instances, re.IGNORECASE)
+            # Trim words the match only partly covers, assuming even character widths
+            char_width = (x1 - x0) / max(len(text), 1)
+            if start > starts[i]:
+                x0 += char_width * (start - starts[i])
+            if end < starts[i] + len(text):
+                x1 -= char_width * (starts[i] + len(text) - end)
             
-            for rect in areas:
+            line = words[i][5:7]
+            if line in rects:
+                rects[line] |= fitz.Rect(x0, y0, x1, y1)
+            else:
+                rects[line] = fitz.Rect(x0, y0, x1, y1)
+        
+        return list(rects.values())
+
+    def remove_sensitive_info(self, page):
+        text, starts, words = self.build_word_index(page)
+        
+        for match in self.sensitive_regex.finditer(text):
+            for rect in self.match_rects(match.start(), match.end(), starts, words):
                 # Make rectangle slightly larger to ensure complete coverage
                 rect.x0 -= 1
                 rect.y0 -= 1
@@ -55,75 +126,183 @@ class PDFProcessor:
                 annot.set_colors(stroke=(1, 1, 1), fill=(1, 1, 1))
                 annot.update()
 
-            # Handle any additional matches found in text extraction
-            for match in matches:
-                # Create a rectangle around the matched text
-                text_rect = fitz.Rect(page.search_for(match.group(0))[0])
-                if text_rect:
-                    page.draw_rect(text_rect, color=(1, 1, 1), fill=(1, 1, 1))
-                    annot = page.add_rect_annot(text_rect)
-                    annot.set_colors(stroke=(1, 1, 1), fill=(1, 1, 1))
-                    annot.update()
+    def build_cover_pdf(self):
+        """The cover page as a one-page PDF, with the image decoded and embedded once"""
+        if self.cover_pdf is None:
+            cover = fitz.open()
+            page = cover.new_page()  # Same default size the cover page always had
+            page.insert_image(page.rect, filename=self.cover_image_path)
+            self.cover_pdf = cover.tobytes(garbage=3, deflate=True)
+            cover.close()
+        return self.cover_pdf
 
     def add_cover_page(self, doc):
-        # Create a new first page
-        doc.insert_page(0)
-        first_page = doc[0]
-        
-        # Open and read the PNG image
-        img = Image.open(self.cover_image_path)
-        
-        # Convert PNG to bytes
-        img_bytes = io.BytesIO()
-        img.save(img_bytes, format='PNG')
-        img_bytes = img_bytes.getvalue()
-        
-        # Insert the image into the PDF
-        rect = first_page.rect  # Get page dimensions
-        first_page.insert_image(rect, stream=img_bytes)
+        # Copy the prebuilt cover page in as the new first page
+        if self.cover_document is None:
+            self.cover_document = fitz.open(stream=self.build_cover_pdf(), filetype="pdf")
+        doc.insert_pdf(self.cover_document, from_page=0, to_page=0, start_at=0)
         
         return doc
 
-    def process_pdfs(self):
+    def plan_outputs(self):
+        """(input path, output path) of every PDF in the input folder.
+
+        Files are numbered per product name in sorted order, so reruns give
+        each input the same output name.
+        """
         # Get list of PDF files
-        pdf_files = [f for f in os.listdir(self.input_folder) if f.endswith('.pdf')]
+        pdf_files = sorted(f for f in os.listdir(self.input_folder) if f.endswith('.pdf'))
         
         # Group files by product name
         product_groups = {}
         for pdf_file in pdf_files:
             product_name = self.extract_product_name(pdf_file)
-            print(product_name)
             if product_name not in product_groups:
                 product_groups[product_name] = []
             product_groups[product_name].append(pdf_file)
 
-        # Process each group
+        jobs = []
         for product_name, files in product_groups.items():
             for index, pdf_file in enumerate(files, 1):
                 input_path = os.path.join(self.input_folder, pdf_file)
-                output_filename = f"{product_name} {index}.pdf"
-                output_path = os.path.join(self.output_folder, output_filename)
-
-                # Open PDF
-                doc = fitz.open(input_path)
-
-                # Add cover page
-                doc = self.add_cover_page(doc)
-
-                # Process each page
-                for page_num in range(1, doc.page_count):  # Skip cover page
-                    page = doc[page_num]
-                    self.remove_sensitive_info(page)
-
-                # Save modified PDF
-                doc.save(output_path)
-                doc.close()
-                print(f"Processed: {output_filename}")
-
-# Usage example
-processor = PDFProcessor(
-    input_folder="input_pdfs",
-    output_folder="output_pdfs",
-    cover_image_path="cover_page.png"
-)
-processor.process_pdfs()
+                output_path = os.path.join(self.output_folder, f"{product_name} {index}.pdf")
+                jobs.append((input_path, output_path))
+        return jobs
+
+    def process_pdf(self, input_path, output_path):
+        """Add the cover page to one PDF, remove sensitive information and save it; returns the page count"""
+        # Open PDF
+        doc = fitz.open(input_path)
+        part_path = output_path + '.part'
+
+        try:
+            # Add cover page
+            doc = self.add_cover_page(doc)
+
+            # Process each page
+            for page_num in range(1, doc.page_count):  # Skip cover page
+                page = doc[page_num]
+                self.remove_sensitive_info(page)
+
+            # Save under a temporary name first so an interrupted run never leaves a partial output
+            page_count = doc.page_count
+            doc.save(part_path)
+            os.replace(part_path, output_path)
+        finally:
+            doc.close()
+            # Left over only if saving failed partway
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        return page_count
+
+    def load_manifest(self, manifest_path):
+        """Completed outputs from earlier runs: output filename -> manifest entry"""
+        completed = {}
+        if not os.path.exists(manifest_path):
+            return completed
+        
+        with open(manifest_path, encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by an interrupted run
+                completed[entry['output']] = entry
+        return completed
+
+    def process_pdfs(self, workers=None, in_flight=None, manifest_path=None, report_path=None):
+        """Process every PDF of the input folder on a pool of worker processes.
+
+        At most in_flight documents (twice the workers by default) are
+        submitted at once. Each finished output is appended to the manifest
+        straight away; outputs listed there whose input has not changed
+        since are skipped, so an interrupted batch can simply be rerun.
+        Per-file timings are written to the report as CSV.
+        """
+        workers = workers or os.cpu_count() or 1
+        in_flight = in_flight or 2 * workers
+        manifest_path = manifest_path or os.path.join(self.output_folder, MANIFEST_NAME)
+        report_path = report_path or os.path.join(self.output_folder, REPORT_NAME)
+        
+        start_time = time.time()
+        completed = self.load_manifest(manifest_path)
+        report = []
+        todo = []
+        
+        for input_path, output_path in self.plan_outputs():
+            output_filename = os.path.basename(output_path)
+            stat = os.stat(input_path)
+            entry = completed.get(output_filename)
+            
+            if (entry and entry['input'] == os.path.basename(input_path) and entry['size'] == stat.st_size
+                    and entry['mtime'] == stat.st_mtime and os.path.exists(output_path)):
+                report.append({'input': entry['input'], 'output': output_filename, 'status': 'skipped',
+                               'pages': entry['pages'], 'seconds': entry['seconds'], 'error': ''})
+            else:
+                todo.append((input_path, output_path, stat))
+        
+        print(f"{len(todo)} PDFs to process, {len(report)} already done, {workers} workers")
+        
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                    initargs=(self.input_folder, self.output_folder,
+                                                              self.cover_image_path, self.patterns,
+                                                              self.build_cover_pdf())) as executor, \
+                open(manifest_path, 'a', encoding='utf-8') as manifest:
+            pending = {}  # future -> (input path, output path, input stat)
+            
+            def finish(future):
+                input_path, output_path, stat = pending.pop(future)
+                row = {'input': os.path.basename(input_path), 'output': os.path.basename(output_path)}
+                try:
+                    pages, seconds = future.result()
+                    print(f"Processed: {row['output']} ({pages} pages in {seconds:.2f} seconds)")
+                    
+                    manifest.write(json.dumps({**row, 'size': stat.st_size, 'mtime': stat.st_mtime,
+                                               'pages': pages, 'seconds': round(seconds, 3)}) + "\n")
+                    manifest.flush()
+                    report.append({**row, 'status': 'done', 'pages': pages, 'seconds': round(seconds, 3), 'error': ''})
+                except Exception as e:
+                    print(f"Failed: {row['input']}: {e}")
+                    report.append({**row, 'status': 'failed', 'pages': '', 'seconds': '', 'error': str(e)})
+            
+            for input_path, output_path, stat in todo:
+                while len(pending) >= in_flight:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        finish(future)
+                
+                pending[executor.submit(process_file, input_path, output_path)] = (input_path, output_path, stat)
+            
+            for future in concurrent.futures.as_completed(list(pending)):
+                finish(future)
+        
+        with open(report_path, 'w', newline='', encoding='utf-8') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=['input', 'output', 'status', 'pages', 'seconds', 'error'])
+            writer.writeheader()
+            writer.writerows(report)
+        
+        counts = {status: sum(row['status'] == status for row in report) for status in ('done', 'skipped', 'failed')}
+        print(f"Processed {counts['done']} PDFs ({counts['skipped']} skipped, {counts['failed']} failed) "
+              f"in {time.time() - start_time:.2f} seconds; timings in {report_path}")
+        return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Add the cover page to PDFs and remove sensitive information")
+    parser.add_argument('--input-folder', default="input_pdfs", help="Folder of PDFs to process")
+    parser.add_argument('--output-folder', default="output_pdfs", help="Folder for the processed PDFs")
+    parser.add_argument('--cover', default="cover_page.png", help="Cover page image")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument('--in-flight', type=int, help="Documents submitted at once (default: twice the workers)")
+    parser.add_argument('--manifest', help=f"Manifest of completed outputs (default: OUTPUT_FOLDER/{MANIFEST_NAME})")
+    parser.add_argument('--report', help=f"Per-file timing report (default: OUTPUT_FOLDER/{REPORT_NAME})")
+    args = parser.parse_args()
+
+    processor = PDFProcessor(
+        input_folder=args.input_folder,
+        output_folder=args.output_folder,
+        cover_image_path=args.cover
+    )
+    processor.process_pdfs(args.workers, args.in_flight, args.manifest, args.report)
+
+if __name__ == "__main__":
+    main()
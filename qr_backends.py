@@ -0,0 +1,114 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+# pyzbar is optional; it also needs the zbar shared library
+try:
+    from pyzbar import pyzbar
+except ImportError:
+    pyzbar = None
+
+# Directory holding detect.prototxt, detect.caffemodel, sr.prototxt and
+# sr.caffemodel for the WeChat CNN detector. Without it WeChat falls back to
+# its traditional (non-CNN) detector.
+WECHAT_MODEL_DIR = os.environ.get('WECHAT_MODEL_DIR')
+
+# Backends created per thread by thread_backend()
+thread_backends = threading.local()
+
+class OpenCVBackend:
+    """OpenCV's classic QRCodeDetector, which also reports codes it located but could not decode"""
+
+    name = 'opencv'
+
+    def __init__(self):
+        self.detector = cv2.QRCodeDetector()
+
+    def detect(self, img):
+        retval, decoded_info, points, _ = self.detector.detectAndDecodeMulti(img)
+        if not retval or points is None:
+            return []
+
+        return [(qr_points, decoded_info[i] if i < len(decoded_info) else "")
+                for i, qr_points in enumerate(points)]
+
+class WeChatBackend:
+    """WeChat's QR engine from opencv-contrib: CNN detector and super-resolution when models are present"""
+
+    name = 'wechat'
+
+    def __init__(self, model_dir=None):
+        if not hasattr(cv2, 'wechat_qrcode_WeChatQRCode'):
+            raise Exception("The wechat backend requires opencv-contrib-python")
+
+        model_dir = model_dir or WECHAT_MODEL_DIR
+        if model_dir:
+            self.detector = cv2.wechat_qrcode_WeChatQRCode(
+                os.path.join(model_dir, 'detect.prototxt'), os.path.join(model_dir, 'detect.caffemodel'),
+                os.path.join(model_dir, 'sr.prototxt'), os.path.join(model_dir, 'sr.caffemodel'))
+        else:
+            self.detector = cv2.wechat_qrcode_WeChatQRCode()
+
+    def detect(self, img):
+        decoded_info, points = self.detector.detectAndDecode(img)
+        return [(np.asarray(qr_points, dtype=np.float32), data) for data, qr_points in zip(decoded_info, points)]
+
+class ZbarBackend:
+    """zbar through pyzbar; only reports codes it could decode"""
+
+    name = 'pyzbar'
+
+    def __init__(self):
+        if pyzbar is None:
+            raise Exception("The pyzbar backend requires the pyzbar package and the zbar library")
+
+    def detect(self, img):
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        codes = []
+        for symbol in pyzbar.decode(img, symbols=[pyzbar.ZBarSymbol.QRCODE]):
+            # zbar outlines can have more than four points; reduce them to a quadrilateral
+            polygon = np.array([(point.x, point.y) for point in symbol.polygon], dtype=np.float32)
+            if len(polygon) != 4:
+                polygon = cv2.boxPoints(cv2.minAreaRect(polygon))
+            codes.append((polygon, symbol.data.decode('utf-8', errors='replace')))
+        return codes
+
+BACKENDS = {
+    OpenCVBackend.name: OpenCVBackend,
+    WeChatBackend.name: WeChatBackend,
+    ZbarBackend.name: ZbarBackend
+}
+
+def create_backend(name):
+    """Create a detector backend by name.
+
+    Every backend has detect(img) returning [(points, data)]: points are the
+    four corners in image pixels, data is '' for codes that were located but
+    not decoded.
+    """
+    if name not in BACKENDS:
+        raise Exception(f"Unknown QR backend '{name}' (available: {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+def thread_backend(name):
+    """The calling thread's instance of a backend, created on first use"""
+    backends = getattr(thread_backends, 'backends', None)
+    if backends is None:
+        backends = thread_backends.backends = {}
+    if name not in backends:
+        backends[name] = create_backend(name)
+    return backends[name]
+
+def available_backends():
+    """Names of the backends that can be created in this environment"""
+    available = []
+    for name in BACKENDS:
+        try:
+            create_backend(name)
+            available.append(name)
+        except Exception:
+            pass
+    return available
@@ -0,0 +1,160 @@
+import threading
+import cv2
+import numpy as np
+
+# Finder-pattern scanning and the contour fallback, shared by the extractors
+
+FINDER_RATIOS = np.array([1, 1, 3, 1, 1])  # Dark/light run widths across a finder pattern, in modules
+OTSU_SAMPLE_STEP = 4  # The finder scan's binarization threshold is picked from every Nth row and column
+CONTOUR_MIN_SIZE = 30 * 72 / 200  # Smallest shape reported by the contour fallback, in PDF points
+CONTOUR_MIN_FINDERS = 3  # Finder-pattern candidates a shape needs before it is checked (a QR code has three)
+CONTOUR_PADDING = 0.1    # Fraction of a shape's size added around it when looking for finder patterns
+CONTOUR_NMS_THRESHOLD = 0.5  # Overlapping shapes above this IoU are reported once
+CONTOUR_MIN_COVERAGE = 0.5  # Share of a shape's box the QR code located in it must cover
+
+# QR code locators used by the contour fallback, one per thread
+thread_locators = threading.local()
+
+def scan_finder_runs(binary, step):
+    """Mark the centre runs of 1:1:3:1:1 dark/light run sequences in every row.
+
+    binary holds 1 for dark pixels and only the rows to scan. Returns a
+    boolean grid with one row per row of binary, sampled at every step-th
+    column, that is set where a matching sequence's centre (3-module) run
+    lies. All rows are run-length encoded at once.
+    """
+    rows_img = cv2.copyMakeBorder(binary, 0, 0, 1, 1, cv2.BORDER_CONSTANT, value=0)
+    height, padded_width = rows_img.shape
+    grid_width = -(-(padded_width - 2) // step)
+    grid = np.zeros((height, grid_width), dtype=bool)
+    
+    # Colour changes, in row-major order; consecutive ones delimit runs
+    rows, cols = np.divmod(np.flatnonzero(rows_img[:, 1:] != rows_img[:, :-1]), padded_width - 1)
+    if len(cols) < 6:
+        return grid
+    
+    # Every window of five runs starting with a dark one, within a single row
+    runs = np.lib.stride_tricks.sliding_window_view(np.diff(cols), 5)
+    starts = np.arange(len(runs))
+    module = runs.sum(axis=1) / 7
+    expected = module[:, None] * FINDER_RATIOS
+    hits = starts[(rows[starts + 5] == rows[starts]) &
+                  (rows_img[rows[starts], cols[starts] + 1] == 1) &
+                  (module >= 1) &
+                  (np.abs(runs - expected) < expected / 2 + 0.5).all(axis=1)]
+    if not len(hits):
+        return grid
+    
+    # Fill each centre run's grid cells through a cumulative sum over the rows that have hits
+    hit_rows, row_index = np.unique(rows[hits], return_inverse=True)
+    offsets = row_index * (grid_width + 1)
+    marks = np.bincount(np.concatenate([offsets + -(-cols[hits + 2] // step), offsets + -(-cols[hits + 3] // step)]),
+                        np.repeat([1, -1], len(hits)), minlength=len(hit_rows) * (grid_width + 1))
+    grid[hit_rows] = np.cumsum(marks.reshape(len(hit_rows), grid_width + 1), axis=1)[:, :grid_width] > 0
+    return grid
+
+def count_finder_patterns(img, step=1):
+    """Count finder-pattern candidates in an image: places where 1:1:3:1:1 runs cross.
+
+    A finder pattern shows the ratio both across and down through its centre,
+    so candidates are where horizontal and vertical centre runs overlap. This
+    is a cheap test that an image might hold a QR code at all. Only every
+    step-th row and column is scanned, and only those lines are binarized.
+    """
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    threshold, _ = cv2.threshold(gray[::OTSU_SAMPLE_STEP, ::OTSU_SAMPLE_STEP], 0, 1,
+                                 cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, rows = cv2.threshold(gray[::step], threshold, 1, cv2.THRESH_BINARY_INV)
+    horizontal = scan_finder_runs(rows, step)
+    
+    # A crossing needs a horizontal centre run, so only columns holding one are scanned downwards
+    cols = np.flatnonzero(horizontal.any(axis=0))
+    if not len(cols):
+        return 0
+    _, columns = cv2.threshold(cv2.transpose(gray[:, cols * step]), threshold, 1, cv2.THRESH_BINARY_INV)
+    crossings = np.zeros_like(horizontal)
+    crossings[:, cols] = horizontal[:, cols] & scan_finder_runs(columns, step).T
+    count, _ = cv2.connectedComponents(crossings.view(np.uint8))
+    return count - 1
+
+def locate_qr_code(img):
+    """Area of the QR code OpenCV locates in an image (three finder patterns in place), decoded or not; 0 if none"""
+    locator = getattr(thread_locators, 'locator', None)
+    if locator is None:
+        locator = thread_locators.locator = cv2.QRCodeDetector()
+    found, points = locator.detect(img)
+    if not found or points is None:
+        return 0
+    return cv2.contourArea(points.reshape(-1, 2).astype(np.float32))
+
+def find_contour_candidates(img, page_num, page_width, page_height, min_size=CONTOUR_MIN_SIZE):
+    """
+    Find shapes on a page that look like QR codes the detector could not read.
+    
+    Works on the image already rendered for detection. The bounding boxes of
+    all contours are filtered at once with NumPy and overlapping boxes are
+    merged with non-maximum suppression. A shape is only reported if it
+    shows CONTOUR_MIN_FINDERS finder-pattern candidates and OpenCV then
+    locates a QR code filling most of it, so squares, photos, textures and
+    tables are left out.
+    
+    Args:
+        img: OpenCV image of the page (BGR or grayscale)
+        page_num (int): Page index (0-based)
+        page_width (float): Page width in PDF points
+        page_height (float): Page height in PDF points
+        min_size (float): Smallest shape reported, in the same units as the page size
+        
+    Returns:
+        list: List of potential QR code information dictionaries
+    """
+    # Dark shapes on the light page become the foreground
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return []
+    
+    # Somewhat square and not too small, measured in PDF points
+    img_height, img_width = gray.shape
+    rects = np.array([cv2.boundingRect(contour) for contour in contours])
+    x, y, w, h = rects.T
+    min_side = min_size * min(img_width / page_width, img_height / page_height)
+    rects = rects[(w >= min_side) & (h >= min_side) & (w >= 0.7 * h) & (w <= 1.3 * h)]
+    if not len(rects):
+        return []
+    
+    # Larger shapes win over the ones they overlap
+    keep = cv2.dnn.NMSBoxes(rects.tolist(), (rects[:, 2] * rects[:, 3]).astype(float).tolist(),
+                            0, CONTOUR_NMS_THRESHOLD)
+    
+    candidates = []
+    for x, y, w, h in rects[np.asarray(keep, dtype=int).reshape(-1)].tolist():
+        pad_x, pad_y = int(w * CONTOUR_PADDING), int(h * CONTOUR_PADDING)
+        crop = gray[max(0, y - pad_y):y + h + pad_y, max(0, x - pad_x):x + w + pad_x]
+        if count_finder_patterns(crop) < CONTOUR_MIN_FINDERS or locate_qr_code(crop) < CONTOUR_MIN_COVERAGE * w * h:
+            continue
+        
+        x1 = int(x * page_width / img_width)
+        y1 = int(y * page_height / img_height)
+        x2 = int((x + w) * page_width / img_width)
+        y2 = int((y + h) * page_height / img_height)
+        candidates.append({
+            'page': page_num + 1,
+            'bbox': {
+                'x1': x1,
+                'y1': y1,
+                'x2': x2,
+                'y2': y2,
+                'width': x2 - x1,
+                'height': y2 - y1
+            },
+            'center': {
+                'x': (x1 + x2) / 2,
+                'y': (y1 + y2) / 2
+            },
+            'detection_method': 'contour',
+            'confidence': 'low'  # Shaped like a QR code, but not decoded
+        })
+    
+    return candidates
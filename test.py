@@ -12,6 +12,10 @@ from functools import partial
 from flask import Flask, request, jsonify  # Import Flask and request modules
 import uuid  # Import uuid for generating unique filenames
 import threading  # For periodic resource monitoring
+import qr_backends  # Pluggable QR detector backends
+import qr_shapes  # Finder-pattern checks and the contour fallback
+
+QR_BACKEND = 'opencv'  # Detector backend: 'opencv', 'wechat' or 'pyzbar'
 
 app = Flask(__name__)  # Create a Flask application
 
@@ -198,12 +202,12 @@ def process_page(page_info, temp_dir, qr_detector=None):
         
         # Initialize detector if not provided
         if qr_detector is None:
-            qr_detector = cv2.QRCodeDetector()
+            qr_detector = qr_backends.thread_backend(QR_BACKEND)
         
         # Detect QR codes
-        retval, decoded_info, points, straight_qrcode = qr_detector.detectAndDecodeMulti(img)
+        detections = qr_detector.detect(img)
         
-        if retval:
+        if detections:
             # Image dimensions
             img_height, img_width = img.shape[:2]
             
@@ -212,7 +216,7 @@ def process_page(page_info, temp_dir, qr_detector=None):
             scale_y = page_height / img_height
             
             # Process each QR code found
-            for i, qr_points in enumerate(points):
+            for qr_points, data in detections:
                 # Convert to a four-point array if needed
                 qr_points = qr_points.astype(int)
                 
@@ -244,10 +248,14 @@ def process_page(page_info, temp_dir, qr_detector=None):
                         'x': (min_x + max_x) / 2,
                         'y': (min_y + max_y) / 2
                     },
-                    'data': decoded_info[i] if i < len(decoded_info) else "Unable to decode"
+                    'data': data
                 }
                 
                 page_results.append(qr_info)
+        
+        # Shapes that look like QR codes stand in when the detector found nothing on this page
+        if not page_results:
+            page_results = qr_shapes.find_contour_candidates(img, page_num, page_width, page_height)
     
     except Exception as e:
         error_msg = f"Error processing page {page_num + 1}: {e}"
@@ -266,98 +274,6 @@ def process_page(page_info, temp_dir, qr_detector=None):
     
     return page_results
 
-def process_page_contours(page_info, temp_dir):
-    """
-    Process a single PDF page with contour-based detection.
-    
-    Args:
-        page_info (tuple): Tuple containing (page_num, page, page_width, page_height)
-        temp_dir (str): Directory to store temporary images
-        
-    Returns:
-        list: List of potential QR code information dictionaries
-    """
-    page_num, page, page_width, page_height = page_info
-    page_results = []
-    
-    # Create a unique filename for this page
-    temp_filename = os.path.join(temp_dir, f"page_{page_num}_contour.png")
-    
-    try:
-        # Convert PDF page to an image
-        pix = page.get_pixmap(matrix=fitz.Matrix(200/72, 200/72))
-        pix.save(temp_filename)
-        
-        # Read the image
-        img = cv2.imread(temp_filename)
-        if img is None:
-            return []
-            
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Apply threshold
-        _, thresh = cv2.threshold(gray, 150, 255, cv2.THRESH_BINARY)
-        
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Image dimensions
-        img_height, img_width = img.shape[:2]
-        
-        # Scale factors
-        scale_x = page_width / img_width
-        scale_y = page_height / img_height
-        
-        # Look for square-like contours (potential QR codes)
-        for contour in contours:
-            # Get bounding rectangle
-            x, y, w, h = cv2.boundingRect(contour)
-            
-            # QR codes are typically square-ish, calculate aspect ratio
-            aspect_ratio = float(w) / h
-            
-            # Check if it's somewhat square and not too small
-            if 0.7 <= aspect_ratio <= 1.3 and w >= 30 and h >= 30:
-                # Convert to PDF coordinates
-                pdf_x1 = int(x * scale_x)
-                pdf_y1 = int(y * scale_y)
-                pdf_x2 = int((x + w) * scale_x)
-                pdf_y2 = int((y + h) * scale_y)
-                
-                qr_info = {
-                    'page': page_num + 1,
-                    'bbox': {
-                        'x1': pdf_x1,
-                        'y1': pdf_y1,
-                        'x2': pdf_x2,
-                        'y2': pdf_y2,
-                        'width': pdf_x2 - pdf_x1,
-                        'height': pdf_y2 - pdf_y1
-                    },
-                    'center': {
-                        'x': (pdf_x1 + pdf_x2) / 2,
-                        'y': (pdf_y1 + pdf_y2) / 2
-                    },
-                    'detection_method': 'contour',
-                    'confidence': 'low'  # This is just a potential QR code
-                }
-                
-                page_results.append(qr_info)
-    
-    except Exception as e:
-        print(f"Error in contour processing for page {page_num + 1}: {e}")
-    
-    finally:
-        # Clean up temp file
-        try:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-        except:
-            pass
-    
-    return page_results
-
 def extract_qr_positions_from_pdf(pdf_path, max_workers=None):
     """
     Extract positions of QR codes from a PDF file using OpenCV in parallel.
@@ -409,7 +325,7 @@ def extract_qr_positions_from_pdf(pdf_path, max_workers=None):
                      for page_num, page in enumerate(pdf_document)]
         
         # Create QR detector to share among workers
-        qr_detector = cv2.QRCodeDetector()
+        qr_detector = qr_backends.create_backend(QR_BACKEND)
         
         # Process pages in parallel - limit max workers to avoid too many concurrent file operations
         if max_workers is None:
@@ -479,110 +395,6 @@ def process_page_with_stats(page_info, temp_dir, qr_detector=None):
     
     return process_page(page_info, temp_dir, qr_detector)
 
-def extract_qr_with_contours(pdf_path, max_workers=None):
-    """
-    Alternative approach to detect potential QR code positions using contour detection in parallel.
-    This might help when regular QR code detection fails.
-    """
-    results = []
-    errors = []
-    
-    # Create a temporary directory in the application's root folder instead of system temp
-    temp_dir = os.path.join(os.getcwd(), "temp", f"qr_extract_alt_{int(time.time())}")
-    try:
-        os.makedirs(temp_dir, exist_ok=True)
-        print(f"Created alternative method temporary directory: {temp_dir}")
-    except Exception as e:
-        error_msg = f"Failed to create temporary directory for alternative method: {e}"
-        print(error_msg)
-        raise Exception(error_msg)
-    
-    try:
-        # Open the PDF file
-        try:
-            pdf_document = fitz.open(pdf_path)
-        except Exception as e:
-            error_msg = f"Failed to open PDF document for contour detection: {e}"
-            print(error_msg)
-            raise Exception(error_msg)
-        
-        # Prepare page information
-        page_infos = [(page_num, page, page.rect.width, page.rect.height) 
-                     for page_num, page in enumerate(pdf_document)]
-        
-        # Process pages in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Create a partial function with the temp_dir
-            process_func = partial(process_page_contours, temp_dir=temp_dir)
-            
-            # Submit all tasks and collect futures
-            future_to_page = {executor.submit(process_func, page_info): page_info[0] 
-                             for page_info in page_infos}
-            
-            # Process results as they complete
-            all_potential_qrs = []
-            for future in concurrent.futures.as_completed(future_to_page):
-                page_num = future_to_page[future]
-                try:
-                    page_qrs = future.result()
-                    all_potential_qrs.append(page_qrs)
-                except Exception as e:
-                    error_msg = f"Error in contour processing for page {page_num + 1}: {e}"
-                    print(error_msg)
-                    errors.append(error_msg)
-            
-            # Flatten the list of lists
-            potential_qrs = [qr for page_qrs in all_potential_qrs for qr in page_qrs]
-            
-            # Filter out overlapping detections
-            for qr in potential_qrs:
-                # Check if this QR code overlaps with any we've already found
-                overlap = False
-                for existing in results:
-                    if existing['page'] == qr['page']:
-                        # Extract bbox coordinates
-                        ex1, ey1 = existing['bbox']['x1'], existing['bbox']['y1']
-                        ex2, ey2 = existing['bbox']['x2'], existing['bbox']['y2']
-                        qx1, qy1 = qr['bbox']['x1'], qr['bbox']['y1']
-                        qx2, qy2 = qr['bbox']['x2'], qr['bbox']['y2']
-                        
-                        # Calculate overlap
-                        overlap_x = max(0, min(qx2, ex2) - max(qx1, ex1))
-                        overlap_y = max(0, min(qy2, ey2) - max(qy1, ey1))
-                        overlap_area = overlap_x * overlap_y
-                        
-                        # Calculate areas
-                        qr_area = qr['bbox']['width'] * qr['bbox']['height']
-                        existing_area = existing['bbox']['width'] * existing['bbox']['height']
-                        
-                        # Check if significant overlap
-                        if overlap_area > 0.5 * min(qr_area, existing_area):
-                            overlap = True
-                            break
-                
-                if not overlap:
-                    results.append(qr)
-        
-        pdf_document.close()
-        
-        # If we have errors and no results, raise an exception
-        if len(errors) > 0:
-            raise Exception(f"Contour detection failed: {'; '.join(errors)}")
-        
-    except Exception as e:
-        error_msg = f"Error in contour-based QR extraction: {e}"
-        print(error_msg)
-        raise Exception(error_msg)
-    finally:
-        # Clean up with better error handling
-        try:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            print(f"Cleaned up alternative method temporary directory: {temp_dir}")
-        except Exception as e:
-            print(f"Warning: Could not remove temp directory {temp_dir}: {e}")
-    
-    return results
-
 def main():
     # Example usage
     pdf_path = "./3M0SA3E-09LK21CT0 16.pdf"
@@ -596,30 +408,9 @@ def main():
     start_time = time.time()
     
     try:
-        # Try standard QR detection first
+        # Pages where no QR code is detected fall back to shape detection
         qr_positions = extract_qr_positions_from_pdf(pdf_path, max_workers=max_workers)
         
-        # If no QR codes found or very few, try alternative approach
-        if len(qr_positions) < 1:
-            print("Using alternative detection method...")
-            try:
-                alt_positions = extract_qr_with_contours(pdf_path, max_workers=max_workers)
-                
-                # Combine results
-                seen_positions = set()
-                for qr in qr_positions:
-                    # Create a simple key based on page and center coordinates
-                    key = (qr['page'], round(qr['center']['x']), round(qr['center']['y']))
-                    seen_positions.add(key)
-                
-                # Add non-duplicate positions from alternative method
-                for qr in alt_positions:
-                    key = (qr['page'], round(qr['center']['x']), round(qr['center']['y']))
-                    if key not in seen_positions:
-                        qr_positions.append(qr)
-            except Exception as e:
-                print(f"Alternative detection also failed: {e}")
-        
         elapsed_time = time.time() - start_time
         
         # Print the results